@@ -0,0 +1,119 @@
+"""Load time and memory of worker processes per checkpoint format.
+
+Starts --workers processes at once which each load the model, once from
+the ``.pth`` and once from a flat checkpoint converted from it, and run
+a small forward so every weight has been touched. Each worker reports
+its load time and its memory from /proc/self/smaps_rollup: private
+memory is what it holds alone, PSS counts shared pages split between the
+processes which map them. Without --checkpoint a randomly initialised
+model is saved and used.
+
+    python -m benchmarks.checkpoint_memory --checkpoint model/pretrained_models/derain.pth \\
+        --workers 3 --output checkpoints.json
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from .restormer_bench import summarise
+
+FIELDS = ("Rss", "Pss", "Private_Clean", "Private_Dirty", "Shared_Clean")
+
+
+def memory_mb():
+    values = {}
+    with open("/proc/self/smaps_rollup") as rollup:
+        for line in rollup:
+            field, _, rest = line.partition(":")
+            if field in FIELDS:
+                values[field] = int(rest.split()[0]) / 1024
+    values["Private"] = values.pop("Private_Clean") + values.pop("Private_Dirty")
+    return values
+
+
+def worker(model_path, barrier, results):
+    import torch
+
+    from model.clean import load_model
+
+    start = time.perf_counter()
+    model = load_model(Path(model_path))
+    loaded = time.perf_counter() - start
+    with torch.no_grad():
+        model(torch.zeros(1, 3, 64, 64))
+    # every worker holds its model while the others are measured
+    barrier.wait()
+    results.put({"load": loaded, **memory_mb()})
+    barrier.wait()
+
+
+def measure(model_path: Path, workers: int):
+    context = mp.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(str(model_path), barrier, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    samples = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return {
+        "load": summarise([sample["load"] for sample in samples]),
+        "memory_mb": {
+            field: summarise([sample[field] for sample in samples])
+            for field in ("Rss", "Pss", "Private", "Shared_Clean")
+        },
+        "total_pss_mb": sum(sample["Pss"] for sample in samples),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--checkpoint")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--output", default="checkpoints.json")
+    args = parser.parse_args(argv)
+
+    import torch
+
+    from model.checkpoints import convert
+
+    from .restormer_bench import build_model
+
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        # the flat checkpoint is written next to the .pth, so it goes in a copy
+        model_path = Path(directory) / "model.pth"
+        if args.checkpoint:
+            model_path.symlink_to(Path(args.checkpoint).resolve())
+        else:
+            torch.save({"params": build_model().state_dict()}, model_path)
+
+        report["pth"] = measure(model_path, args.workers)
+        convert(model_path)
+        # like a checkpoint converted ahead of time, not pages still being written back
+        os.sync()
+        report["flat"] = measure(model_path, args.workers)
+
+    for name, result in report.items():
+        memory = result["memory_mb"]
+        print(
+            f"{name}: load {result['load']['mean'] * 1000:.0f}ms, per worker "
+            f"private {memory['Private']['mean']:.0f}MB pss {memory['Pss']['mean']:.0f}MB, "
+            f"total pss {result['total_pss_mb']:.0f}MB"
+        )
+
+    with open(args.output, "w") as output:
+        json.dump({"workers": args.workers, "formats": report}, output, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Check the exported TorchScript engine against eager execution.
+
+Exports the model into a temporary cache, loads it back from disk and
+restores images whose sizes aren't multiples of ``img_multiple_of``, so
+the padding goes through the exported graph at shapes it wasn't traced
+with. Fails if any output pixel differs by more than --tolerance levels.
+
+    python -m benchmarks.engine_parity --resolutions 97,250x131 --output engines.json
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from .restormer_bench import build_model, summarise
+
+
+def size_list(value: str):
+    sizes = []
+    for size in value.split(","):
+        height, _, width = size.partition("x")
+        sizes.append((int(height), int(width or height)))
+    return sizes
+
+
+def random_image(height: int, width: int) -> np.ndarray:
+    rng = np.random.default_rng(height * width)
+    return rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def measure(model, image: np.ndarray, warmup: int, repeat: int):
+    from model.clean import restore_array
+
+    samples = []
+    for i in range(warmup + repeat):
+        start = time.perf_counter()
+        restored = restore_array(image, model, tile=0)
+        if i >= warmup:
+            samples.append(time.perf_counter() - start)
+    return restored, summarise(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--checkpoint")
+    parser.add_argument("--resolutions", type=size_list, default=size_list("97,250x131"))
+    parser.add_argument("--execution", default="reference", choices=("reference", "fast"))
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=int, default=1)
+    parser.add_argument("--output", default="engines.json")
+    args = parser.parse_args(argv)
+
+    from model.engines import EagerEngine, TorchScriptEngine
+    from model.precision import apply_precision
+    from model.restormer_fast import optimize
+
+    with tempfile.TemporaryDirectory() as cache:
+        if args.checkpoint:
+            checkpoint = Path(args.checkpoint)
+            weights = torch.load(str(checkpoint))["params"]
+        else:
+            checkpoint = Path(cache) / "random.pth"
+            weights = build_model().state_dict()
+            torch.save({"params": weights}, str(checkpoint))
+
+        def build():
+            model = build_model()
+            model.load_state_dict(weights)
+            if args.execution == "fast":
+                optimize(model)
+            return apply_precision(model, args.precision)
+
+        variant = f"{args.precision}-{args.execution}"
+        eager = EagerEngine().load(build, checkpoint, variant)
+        exporter = TorchScriptEngine(Path(cache))
+        start = time.perf_counter()
+        exporter.load(build, checkpoint, variant)
+        export_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        # the second load comes from the artifact on disk
+        exported = exporter.load(build, checkpoint, variant)
+        load_seconds = time.perf_counter() - start
+
+        results = []
+        for height, width in args.resolutions:
+            image = random_image(height, width)
+            expected, eager_latency = measure(eager, image, args.warmup, args.repeat)
+            restored, exported_latency = measure(exported, image, args.warmup, args.repeat)
+            difference = int(np.abs(expected.astype(int) - restored.astype(int)).max())
+            if difference > args.tolerance:
+                raise SystemExit(
+                    f"{height}x{width}: exported output differs by {difference} levels "
+                    f"(tolerance {args.tolerance})"
+                )
+            results.append(
+                {
+                    "height": height,
+                    "width": width,
+                    "max_level_difference": difference,
+                    "eager": eager_latency,
+                    "torchscript": exported_latency,
+                }
+            )
+            print(
+                f"{height}x{width}: eager {eager_latency['p50'] * 1000:.1f}ms "
+                f"torchscript {exported_latency['p50'] * 1000:.1f}ms max diff {difference}"
+            )
+
+    print(f"export {export_seconds:.1f}s, load from disk {load_seconds:.1f}s")
+    with open(args.output, "w") as output:
+        json.dump(
+            {
+                "execution": args.execution,
+                "precision": args.precision,
+                "export_seconds": export_seconds,
+                "load_seconds": load_seconds,
+                "results": results,
+            },
+            output,
+            indent=2,
+        )
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare the copy-free Restormer execution path against the reference.
+
+Checks that ``model.restormer_fast.optimize`` gives the same output as
+the reference model with the same random weights, then times both.
+
+    python -m benchmarks.fast_bench --resolutions 128,256 --output fast.json
+"""
+import argparse
+import copy
+import json
+import time
+
+import torch
+
+from .restormer_bench import build_model, int_list, summarise
+
+
+def measure(model, input_, warmup: int, repeat: int):
+    samples = []
+    with torch.no_grad():
+        for i in range(warmup + repeat):
+            start = time.perf_counter()
+            model(input_)
+            if i >= warmup:
+                samples.append(time.perf_counter() - start)
+    return summarise(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--resolutions", type=int_list, default=[128, 256])
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    parser.add_argument("--output", default="fast.json")
+    args = parser.parse_args(argv)
+
+    from model.restormer_fast import optimize
+
+    torch.set_num_threads(args.threads)
+    reference = build_model()
+    fast = optimize(copy.deepcopy(reference))
+
+    results = []
+    for resolution in args.resolutions:
+        torch.manual_seed(resolution)
+        input_ = torch.rand(1, 3, resolution, resolution)
+        with torch.no_grad():
+            difference = (reference(input_) - fast(input_)).abs().max().item()
+        if difference > args.tolerance:
+            raise SystemExit(
+                f"{resolution}px: fast output differs by {difference} "
+                f"(tolerance {args.tolerance})"
+            )
+
+        ref_latency = measure(reference, input_, args.warmup, args.repeat)
+        fast_latency = measure(fast, input_, args.warmup, args.repeat)
+        speedup = ref_latency["p50"] / fast_latency["p50"]
+        results.append(
+            {
+                "resolution": resolution,
+                "max_abs_difference": difference,
+                "reference": ref_latency,
+                "fast": fast_latency,
+                "speedup": speedup,
+            }
+        )
+        print(
+            f"{resolution}px: reference {ref_latency['p50'] * 1000:.1f}ms "
+            f"fast {fast_latency['p50'] * 1000:.1f}ms "
+            f"speedup {speedup:.2f}x max diff {difference:.2e}"
+        )
+
+    with open(args.output, "w") as output:
+        json.dump({"threads": args.threads, "results": results}, output, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Quality and speed of the reduced-precision tiers against fp32.
+
+Restores every image with each precision and reports PSNR/SSIM against
+the fp32 output together with the forward latency. Without --checkpoint
+a randomly initialised model is used, which only tells how far the
+precisions drift from fp32, not how good the restoration is.
+
+    python -m benchmarks.quality_report --checkpoint model/pretrained_models/derain.pth \\
+        --images photo1.jpg photo2.jpg --output quality.json
+"""
+import argparse
+import copy
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from skimage.metrics import peak_signal_noise_ratio, structural_similarity
+
+from .restormer_bench import build_model, random_image, summarise
+
+
+def load(checkpoint):
+    from model.clean import load_model
+
+    if checkpoint:
+        return load_model(Path(checkpoint))
+    return build_model()
+
+
+def restore(model, image: np.ndarray):
+    from model.clean import restore_array
+
+    start = time.perf_counter()
+    restored = restore_array(image, model, tile=0)
+    return restored, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--checkpoint")
+    parser.add_argument("--images", nargs="*", default=[])
+    parser.add_argument("--resolution", type=int, default=256)
+    parser.add_argument("--precisions", default="bf16,int8")
+    parser.add_argument("--output", default="quality.json")
+    args = parser.parse_args(argv)
+
+    import cv2
+
+    from model.models import Precision
+    from model.precision import apply_precision
+
+    images = {path: cv2.imread(path, cv2.IMREAD_COLOR) for path in args.images}
+    if not images:
+        images = {f"random_{args.resolution}px": random_image(args.resolution)}
+
+    reference = load(args.checkpoint)
+    models = {Precision.FP32.value: reference}
+    for precision in args.precisions.split(","):
+        precision = Precision(precision).value
+        models[precision] = apply_precision(copy.deepcopy(reference), precision)
+
+    results = {precision: {"images": {}, "latency": []} for precision in models}
+    for name, image in images.items():
+        expected, latency = restore(reference, image)
+        results[Precision.FP32.value]["latency"].append(latency)
+        for precision, model in models.items():
+            if precision == Precision.FP32.value:
+                continue
+            restored, latency = restore(model, image)
+            results[precision]["latency"].append(latency)
+            results[precision]["images"][name] = {
+                "psnr": float(peak_signal_noise_ratio(expected, restored)),
+                "ssim": float(structural_similarity(expected, restored, channel_axis=2)),
+            }
+
+    report = {}
+    for precision, result in results.items():
+        scores = result["images"].values()
+        report[precision] = {
+            "latency": summarise(result["latency"]),
+            "images": result["images"],
+        }
+        if scores:
+            report[precision]["psnr"] = float(np.mean([s["psnr"] for s in scores]))
+            report[precision]["ssim"] = float(np.mean([s["ssim"] for s in scores]))
+        line = f"{precision}: {report[precision]['latency']['mean'] * 1000:.1f}ms"
+        if scores:
+            line += f" psnr {report[precision]['psnr']:.2f}dB ssim {report[precision]['ssim']:.4f}"
+        print(line)
+
+    with open(args.output, "w") as output:
+        json.dump(
+            {"threads": torch.get_num_threads(), "precisions": report}, output, indent=2
+        )
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
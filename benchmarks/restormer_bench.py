@@ -0,0 +1,172 @@
+"""Restormer inference micro-benchmarks.
+
+Runs a randomly initialised Restormer, built with the same parameters as
+``model.clean.load_model``, so no checkpoint is needed. Every combination
+of resolution, thread count and batch size runs in its own process so
+the reported peak RSS belongs to that configuration alone.
+
+    python -m benchmarks.restormer_bench --resolutions 256,512 --threads 1,4 \\
+        --batch-sizes 1,2 --output bench.json
+"""
+import argparse
+import json
+import multiprocessing as mp
+import platform
+import resource
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+
+def percentile(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q)) if samples else 0.0
+
+
+def summarise(samples: List[float]) -> Dict[str, float]:
+    return {
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "mean": float(np.mean(samples)) if samples else 0.0,
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(samples: Dict[str, List[float]], stage: str, fn: Callable, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    samples.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def build_model():
+    import torch
+
+    from model.clean import parameters, restormer_arch
+
+    torch.manual_seed(0)
+    model = restormer_arch()["Restormer"](**parameters)
+    return model.eval()
+
+
+def random_image(resolution: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (resolution, resolution, 3), dtype=np.uint8)
+
+
+def run_config(resolution, threads, batch_size, warmup, repeat):
+    import cv2
+    import torch
+
+    from model import clean
+
+    torch.set_num_threads(threads)
+    model = build_model()
+    image = random_image(resolution)
+    encoded = cv2.imencode(".jpg", image)[1].tobytes()
+    batch = torch.cat([clean.to_tensor(image)] * batch_size)
+    batch, _, _ = clean.pad_input(batch)
+
+    forward = []
+    with torch.no_grad():
+        for i in range(warmup + repeat):
+            start = time.perf_counter()
+            model(batch)
+            if i >= warmup:
+                forward.append(time.perf_counter() - start)
+
+    # the stages of clean_image(), one image at a time
+    stages: Dict[str, List[float]] = {}
+    if batch_size == 1:
+        with torch.no_grad():
+            for i in range(warmup + repeat):
+                current: Dict[str, List[float]] = {}
+                decoded = timed(current, "decode", clean.decode_image, encoded)
+                input_ = clean.to_tensor(decoded)
+                input_, h, w = timed(current, "pad", clean.pad_input, input_)
+                restored = timed(current, "forward", model, input_)
+                restored = timed(current, "clamp_unpad", clean.clamp_unpad, restored, h, w)
+                restored = timed(current, "to_ubyte", clean.to_ubyte, restored)
+                timed(current, "imencode", clean.encode_image, restored)
+                if i >= warmup:
+                    for stage, samples in current.items():
+                        stages.setdefault(stage, []).extend(samples)
+
+    return {
+        "resolution": resolution,
+        "threads": threads,
+        "batch_size": batch_size,
+        "latency": summarise(forward),
+        "images_per_second": batch_size * len(forward) / sum(forward),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {stage: summarise(samples) for stage, samples in stages.items()},
+    }
+
+
+def _child(queue, *args):
+    queue.put(run_config(*args))
+
+
+def run_isolated(*args):
+    context = mp.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(queue, *args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--resolutions", type=int_list, default=[128, 256, 512])
+    parser.add_argument("--threads", type=int_list, default=sorted({1, mp.cpu_count()}))
+    parser.add_argument("--batch-sizes", type=int_list, default=[1])
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="bench.json")
+    args = parser.parse_args(argv)
+
+    import torch
+
+    results = []
+    for resolution in args.resolutions:
+        for threads in args.threads:
+            for batch_size in args.batch_sizes:
+                result = run_isolated(
+                    resolution, threads, batch_size, args.warmup, args.repeat
+                )
+                results.append(result)
+                print(
+                    f"{resolution}px threads={threads} batch={batch_size}: "
+                    f"p50 {result['latency']['p50'] * 1000:.1f}ms "
+                    f"p95 {result['latency']['p95'] * 1000:.1f}ms "
+                    f"{result['images_per_second']:.2f} img/s "
+                    f"rss {result['peak_rss_mb']:.0f}MB"
+                )
+
+    report = {
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": mp.cpu_count(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Startup latency of the API.
+
+Every run starts a fresh interpreter which imports ``main``, runs the
+startup event and polls ``/health/live`` and ``/health/ready``. It
+reports how long the import took, which of the heavy modules it pulled
+in, and when the API was live and ready to serve. Runs from the root
+directory of the project, like the API.
+
+    python -m benchmarks.startup --runs 5 --warmup-models derain --output startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from .restormer_bench import summarise
+
+HEAVY_MODULES = ["torch", "cv2", "einops", "skimage", "boto3"]
+
+RUN = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    started = time.perf_counter() - start
+    live = ready = None
+    while time.perf_counter() - start < {timeout}:
+        if live is None and client.get("/health/live").status_code == 200:
+            live = time.perf_counter() - start
+        if client.get("/health/ready").status_code == 200:
+            ready = time.perf_counter() - start
+            break
+        time.sleep({interval})
+print(json.dumps({{"import": imported, "started": started, "live": live,
+                  "ready": ready, "heavy_modules": heavy}}))
+"""
+
+
+def run_once(timeout: float, interval: float, env) -> dict:
+    code = RUN.format(heavy=HEAVY_MODULES, timeout=timeout, interval=interval)
+    result = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--warmup-models", default="")
+    parser.add_argument("--backend", default="thread")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--output", default="startup.json")
+    args = parser.parse_args(argv)
+
+    env = dict(
+        os.environ,
+        RESTORMER_WARMUP_MODELS=args.warmup_models,
+        RESTORMER_BACKEND=args.backend,
+    )
+    # the API refuses to start without a secret to sign its tokens with
+    env.setdefault("SECRET", "startup-benchmark")
+
+    runs = [run_once(args.timeout, args.interval, env) for _ in range(args.runs)]
+    report = {"runs": runs}
+    for stage in ("import", "started", "live", "ready"):
+        samples = [run[stage] for run in runs if run[stage] is not None]
+        report[stage] = summarise(samples)
+        print(f"{stage}: p50 {report[stage]['p50'] * 1000:.0f}ms")
+    print(f"heavy modules imported with main: {runs[0]['heavy_modules'] or 'none'}")
+
+    with open(args.output, "w") as output:
+        json.dump(
+            {
+                "backend": args.backend,
+                "warmup_models": args.warmup_models,
+                "stages": report,
+            },
+            output,
+            indent=2,
+        )
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Latency of listing the task history of a user in a large database.
+
+Fills a fresh SQLite database with --rows tasks spread over --owners
+users and a year, then times pages of list_tasks, unfiltered and by
+status, model and date, at the start of the history and deep into it.
+Keyset pages are compared with the same pages taken by OFFSET.
+
+    python -m benchmarks.task_history --rows 2000000 --output history.json
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from .restormer_bench import summarise
+
+STATUSES = ["finished"] * 8 + ["failed", "scheduled"]
+MODELS = ["derain", "deblur", "derain+deblur"]
+OWNER = "user0"
+# how SQLAlchemy writes datetimes to SQLite, which compares them as text
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def fill(engine, rows: int, owners: int, chunk: int = 50000):
+    from utils.sqlite_models import TaskStatus
+
+    start = datetime(2025, 1, 1)
+    step = timedelta(days=365) / rows
+    statuses = [TaskStatus(status).name for status in STATUSES]
+    random.seed(0)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for first in range(0, rows, chunk):
+            batch = []
+            for i in range(first, min(rows, first + chunk)):
+                created = start + step * i
+                # a tenth of the history belongs to the user being listed
+                owner = OWNER if i % 10 == 0 else f"user{random.randrange(1, owners)}"
+                batch.append(
+                    (
+                        owner,
+                        random.choice(MODELS),
+                        f"{i}.png",
+                        f"{i}_processed.png",
+                        random.choice(statuses),
+                        created.strftime(DATETIME_FORMAT),
+                        (created + timedelta(seconds=5)).strftime(DATETIME_FORMAT),
+                    )
+                )
+            cursor.executemany(
+                "INSERT INTO task (owner, model, source, output, status, created_at,"
+                " finished_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+            connection.commit()
+        cursor.execute("ANALYZE")
+    finally:
+        connection.close()
+
+
+def timed(function, repeat: int):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - started)
+    return summarise(latencies)
+
+
+def query_plan(engine, query):
+    compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")
+        return [row[-1] for row in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--owners", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--depths", default="0,100,1000", help="pages into the history")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default="history.json")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    # utils.db creates its engine for this url when it's imported
+    os.environ["DATABASE_URL"] = f"sqlite:///{directory}/history.sqlite"
+    from utils.db import (
+        engine,
+        get_task,
+        init_db,
+        list_tasks,
+        new_session,
+        task_history,
+    )
+    from utils.sqlite_models import TaskStatus
+
+    init_db()
+    started = time.perf_counter()
+    fill(engine, args.rows, args.owners)
+    print(f"Filled {args.rows} tasks in {time.perf_counter() - started:.1f}s")
+
+    size = args.page_size
+    april = datetime(2025, 4, 1, tzinfo=timezone.utc)
+    filters = {
+        "all": {},
+        "status": {"status": TaskStatus.FAILED},
+        "model": {"model": "derain+deblur"},
+        "date": {"since": april, "until": april + timedelta(days=30)},
+    }
+
+    report = {"rows": args.rows, "pageSize": size, "pages": {}, "plans": {}}
+    for name, where in filters.items():
+        # the cursor of every depth is found by paging there first
+        page = list_tasks(OWNER, limit=size, **where)
+        cursors, depth = {0: None}, 0
+        depths = [int(d) for d in args.depths.split(",")]
+        while depth < max(depths) and len(page) == size:
+            depth += 1
+            after = (page[-1].created_at, page[-1].id)
+            page = list_tasks(OWNER, after=after, limit=size, **where)
+            cursors[depth] = after
+        for depth in depths:
+            if depth not in cursors:
+                continue
+            after = cursors[depth]
+            keyset = timed(
+                lambda: list_tasks(OWNER, after=after, limit=size, **where),
+                args.repeat,
+            )
+
+            def by_offset():
+                query = task_history(OWNER, **where)
+                with new_session() as session:
+                    list(session.exec(query.offset(depth * size).limit(size)))
+
+            offset = timed(by_offset, args.repeat)
+            report["pages"][f"{name}@{depth}"] = {"keyset": keyset, "offset": offset}
+            print(
+                f"{name} page {depth}: keyset {keyset['mean'] * 1000:.2f}ms"
+                f" offset {offset['mean'] * 1000:.2f}ms"
+            )
+        query = task_history(OWNER, after=cursors[max(cursors)], **where)
+        report["plans"][name] = query_plan(engine, query.limit(size))
+
+    ids = random.sample(range(1, args.rows + 1), 1000)
+    lookups = timed(lambda: [get_task(task_id) for task_id in ids], 3)
+    report["getTask"] = {"mean": lookups["mean"] / len(ids)}
+    print(f"get_task {lookups['mean'] / len(ids) * 1e6:.0f}us")
+    for name, plan in report["plans"].items():
+        print(f"{name}: {'; '.join(plan)}")
+
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,35 @@
+import asyncio
+import base64
+import json
 import os
 import secrets
 import uuid
+from collections import Counter
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import List, Optional
 
 from dotenv import load_dotenv
-from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, UploadFile, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
-from model.clean import clean
-from model.models import Model
-from sqlmodel import Session, SQLModel
+from model import inference
+from model.admission import Admission, Decision
+from model.inference import admit
+from model.models import ImageFormat, Model, Precision
+from model.settings import BACKEND, PRECISION, WORKERS
+from pipeline import (
+    QUEUE_BACKEND,
+    in_flight,
+    job_key,
+    make_queue,
+    outputs,
+    set_task_status,
+    task_links,
+)
 from typing_extensions import Annotated
 from utils.auth import (
     Token,
@@ -21,11 +39,36 @@ from utils.auth import (
     create_access_token,
     decode_access_token,
 )
-from utils.core import AppState
-from utils.db import engine, get_task, set_task_uploaded_to, update_task_status
+from utils.archive import stream_zip
+from utils.cache import CacheStats
+from utils.core import AppState, JobState, TaskPage, TaskSummary
+from utils.db import (
+    create_job,
+    delete_task,
+    get_finished_task_by_hash,
+    get_finished_tasks_by_hashes,
+    get_job,
+    get_job_tasks,
+    get_latest_task,
+    get_task,
+    init_db,
+    list_tasks,
+    new_session,
+    update_job_status,
+)
+from utils.events import server_sent_event, task_events
+from utils.ingest import (
+    IngestedFile,
+    InvalidContent,
+    UploadTooLarge,
+    extract_zip,
+    ingest,
+)
+from utils.jobs import QueueFull
 from utils.message import BadError, Error, ResponseErrors, Success
-from utils.sqlite_models import Task, TaskStatus
-from utils.upload import S3_BUCKET, upload, upload_to_local
+from utils.metrics import Collected, metrics
+from utils.sqlite_models import Task, TaskStage, TaskStatus
+from utils.upload import LOCAL_BUCKET, read_object
 
 origin = os.getenv("CORS_ORIGIN", "http://localhost:3000")
 
@@ -44,19 +87,10 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 
 # Init functions
-def init_db():
-    SQLModel.metadata.create_all(engine)
-
-
-def init_state():
-    with open("state.json", "w") as jf:
-        state = AppState(status=TaskStatus.FINISHED, task_id=None)
-        jf.write(state.model_dump_json())
-
-
 def create_token(size):
     return secrets.token_hex(size)
 
@@ -65,33 +99,157 @@ temp_user = UserInRuntime(username=create_token(8), password=create_token(32))
 print(f"Use this token to login: {temp_user}")
 
 
-@app.on_event("startup")
-def startup():
-    init_db()
-    init_state()
-
-
-MAX_FILE_SIZE = os.getenv("RESTORMER_MAX_FILE_SIZE", 250)
+MAX_FILE_SIZE = int(os.getenv("RESTORMER_MAX_FILE_SIZE") or 250)
 
 ALLOWED_FILE_TYPES = ["jpeg", "jpg", "png"]
 
+# in kbs, the whole body of a /bulk upload, zips included
+MAX_BULK_SIZE = int(os.getenv("RESTORMER_MAX_BULK_SIZE") or 50 * 1024)
+MAX_BULK_FILES = int(os.getenv("RESTORMER_MAX_BULK_FILES") or 200)
+
+# in seconds, how often a streamed archive checks for newly finished tasks
+ARCHIVE_POLL_INTERVAL = 1.0
+
+# in seconds, idle progress streams get a comment this often
+SSE_KEEPALIVE = 15.0
+
+# tasks one page of /tasks lists at most
+MAX_PAGE_SIZE = int(os.getenv("RESTORMER_MAX_PAGE_SIZE") or 200)
+
+# models one /clean can chain, e.g. ?model=derain&model=deblur
+MAX_CHAINED_MODELS = int(os.getenv("RESTORMER_MAX_CHAINED_MODELS") or 3)
+
+# /clean parses the multipart body itself, so the file field is documented here
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
+
+
+BULK_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "files": {
+                            "type": "array",
+                            "items": {"type": "string", "format": "binary"},
+                            "description": "images, or zips of images",
+                        }
+                    },
+                    "required": ["files"],
+                }
+            }
+        },
+    }
+}
+
+
+cache_stats = CacheStats()
+
+# 0 with the database queue leaves the tasks to worker.py processes
+jobs = make_queue(WORKERS)
+
+
+def busy_workers():
+    if BACKEND == "process":
+        stack = inference.loaded()
+        return [({}, stack.pool.busy if stack else 0)]
+    return [({}, jobs.busy)]
+
+
+def resident_model_bytes():
+    stack = inference.loaded()
+    return [({}, stack.registry.memory_used if stack else 0)]
+
+
+def batch_stats(key):
+    stack = inference.loaded()
+    if not stack:
+        return []
+    return [
+        ({"model": name}, stats[key]) for name, stats in stack.batchers.stats().items()
+    ]
+
+
+metrics.register(
+    Collected(
+        "restormer_queue_depth",
+        "Tasks waiting for a worker",
+        "gauge",
+        lambda: [({}, jobs.depth)],
+    )
+)
+metrics.register(
+    Collected("restormer_busy_workers", "Workers running inference", "gauge", busy_workers)
+)
+metrics.register(
+    Collected(
+        "restormer_resident_model_bytes",
+        "Memory held by models loaded in the API process, the models of"
+        " the process backend and of worker.py live in their own processes",
+        "gauge",
+        resident_model_bytes,
+    )
+)
+metrics.register(
+    Collected(
+        "restormer_cache_requests_total",
+        "Uploads answered from a finished task, an in-flight task or neither",
+        "counter",
+        lambda: [
+            ({"result": "hit"}, cache_stats.hits),
+            ({"result": "in_flight"}, cache_stats.in_flight_hits),
+            ({"result": "miss"}, cache_stats.misses),
+        ],
+    )
+)
+metrics.register(
+    Collected(
+        "restormer_batch_fill_ratio",
+        "Average share of the maximum batch size used per batched forward",
+        "gauge",
+        lambda: batch_stats("fill"),
+    )
+)
+metrics.register(
+    Collected(
+        "restormer_batch_wait_seconds",
+        "Average time work waited to be batched",
+        "gauge",
+        lambda: batch_stats("mean_wait"),
+    )
+)
 
-def clean_image_concurrently(task_id: int, model: str) -> None:
-    update_task_status(task_id, TaskStatus.PROCESSING)
-    task = get_task(task_id)
-    if task:
-        input_ = Path("static") / task.source
 
-        output_image = clean(input_, model).read()
+@app.on_event("startup")
+def startup():
+    init_db()
+    # torch and the models load in the background, /health/ready tells when
+    # they're there. An API which leaves the tasks to worker.py never loads them
+    if jobs.workers:
+        inference.start()
+    jobs.start()
 
-        update_task_status(task_id, TaskStatus.UPLOADING)
-        with open(input_, "rb") as image:
-            input_image = image.read()
-        input_uploaded_to = upload(task.source, input_image)
-        output_uploaded_to = upload(task.output, output_image)
 
-        set_task_uploaded_to(task_id, input_uploaded_to)
-        update_task_status(task_id, TaskStatus.FINISHED)
+@app.on_event("shutdown")
+def shutdown():
+    jobs.stop()
+    outputs.shutdown()
+    inference.stop()
 
 
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
@@ -106,9 +264,54 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     return user
 
 
-@app.get("/health", response_model=Success)
-def check_health(response: Response):
-    return Success(details="running")
+async def get_stream_user(
+    header_token: Annotated[Optional[str], Depends(optional_oauth2_scheme)],
+    token: Optional[str] = None,
+):
+    # EventSource can't set headers, so browsers pass the token as ?token=
+    return await get_current_user(header_token or token or "")
+
+
+@app.get("/health/live", response_model=Success)
+def check_liveness():
+    return Success(details="alive")
+
+
+@app.get(
+    "/health/ready",
+    response_model=Success,
+    responses={status.HTTP_503_SERVICE_UNAVAILABLE: {"model": Error}},
+)
+def check_readiness():
+    stack = inference.loaded()
+    state = {
+        "inference": inference.ready.is_set(),
+        "failed": inference.error is not None,
+        "residentModels": stack.registry.resident if stack else [],
+        "workers": jobs.alive,
+        "queueDepth": jobs.depth,
+    }
+    ready = state["inference"] and jobs.alive > 0 and jobs.depth < jobs.max_size
+    if not jobs.workers:
+        # worker.py processes run the tasks, they only need room in the queue
+        ready = jobs.depth < jobs.max_size
+    elif BACKEND == "process":
+        # every worker process warms up its own models
+        state["processes"] = stack.pool.ready if stack else 0
+        ready = ready and state["processes"] > 0
+    if not ready:
+        return JSONResponse(
+            {**ResponseErrors.NOT_READY.value, "data": state},
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    return Success(details="ready", data=state)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 @app.post("/token", response_model=Token)
@@ -125,25 +328,253 @@ def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depen
 
 
 @app.get("/progress", response_model=AppState)
-def get_progress(current_user: Annotated[User, Depends(get_current_user)]):
-    with open("state.json", "r") as jf:
-        state = AppState.model_validate_json(jf.read())
-    return state
+def get_progress(
+    current_user: Annotated[User, Depends(get_current_user)],
+    task_id: Optional[int] = None,
+):
+    task = get_task(task_id) if task_id is not None else get_latest_task()
+    if not task and task_id is not None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if not task:
+        # nothing was uploaded yet
+        return AppState(status=TaskStatus.FINISHED, task_id=task_id)
+
+    return AppState(
+        status=task.status,
+        task_id=task.id,
+        stage=task.stage,
+        admission=task.admission,
+        memory_estimate=task.memory_estimate,
+        scale=task.scale,
+        queue_position=jobs.position(task.id),
+        queued_at=task.queued_at,
+        started_at=task.started_at,
+        uploaded_at=task.uploaded_at,
+        finished_at=task.finished_at,
+    )
+
+
+@app.get("/bulk/progress", response_model=JobState)
+def get_bulk_progress(
+    job_id: int, current_user: Annotated[User, Depends(get_current_user)]
+):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    return JobState(
+        status=job.status,
+        job_id=job.id,
+        total=job.total,
+        tasks=Counter(task.status.value for task in get_job_tasks(job_id)),
+        queue_position=jobs.position(job_key(job_id)),
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+    )
+
+
+async def finished_outputs(job_id: int):
+    """The outputs of the tasks of a job, in the order they finish"""
+    sent = set()
+    while True:
+        tasks = await run_in_threadpool(get_job_tasks, job_id)
+        for task in tasks:
+            if task.id in sent:
+                continue
+            if task.status not in (TaskStatus.FINISHED, TaskStatus.FAILED):
+                continue
+            sent.add(task.id)
+            if task.status == TaskStatus.FINISHED:
+                place = task.output_uploaded_to or task.uploaded_to
+                content = read_object(task.output, place)
+                yield task.output, iterate_in_threadpool(content)
+        if len(sent) == len(tasks):
+            return
+        # waiting on the event loop keeps the threadpool free for the others
+        await asyncio.sleep(ARCHIVE_POLL_INTERVAL)
+
+
+@app.get("/bulk/archive")
+def get_bulk_archive(
+    job_id: int, current_user: Annotated[User, Depends(get_current_user)]
+):
+    if not get_job(job_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    return StreamingResponse(
+        stream_zip(finished_outputs(job_id)),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="job_{job_id}.zip"'},
+    )
+
+
+async def polled_events(task_id: int, first: dict):
+    """The events of a task which may run in another process, which only
+    publishes them there, so its status is also polled from the database"""
+    status = first["status"]
+    idle = 0.0
+    async for event in task_events.subscribe(task_id, first, ARCHIVE_POLL_INTERVAL):
+        if event is None:
+            task = await run_in_threadpool(get_task, task_id)
+            if task and task.status != status:
+                event = {"task_id": task_id, "status": task.status, "stage": task.stage}
+                if task.status in (TaskStatus.FINISHED, TaskStatus.FAILED):
+                    event.update(await run_in_threadpool(task_links, task_id))
+            else:
+                idle += ARCHIVE_POLL_INTERVAL
+                if idle >= SSE_KEEPALIVE:
+                    idle = 0.0
+                    yield None
+                continue
+        idle = 0.0
+        status = event["status"]
+        yield event
+        if status in (TaskStatus.FINISHED, TaskStatus.FAILED):
+            return
+
+
+@app.get("/progress/stream")
+async def stream_progress(
+    task_id: int, current_user: Annotated[User, Depends(get_stream_user)]
+):
+    """Server-sent events with every change of the task, the last one has
+    the links /link would return"""
+    task = await run_in_threadpool(get_task, task_id)
+    if not task:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    first = {
+        "task_id": task.id,
+        "status": task.status,
+        "stage": task.stage,
+        "queue_position": jobs.position(task.id),
+    }
+    if task.status in (TaskStatus.FINISHED, TaskStatus.FAILED):
+        first.update(await run_in_threadpool(task_links, task.id))
+    if QUEUE_BACKEND == "database":
+        events = polled_events(task.id, first)
+    else:
+        events = task_events.subscribe(task.id, first, SSE_KEEPALIVE)
+    return StreamingResponse(
+        (server_sent_event(event) async for event in events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def encode_cursor(task: Task) -> str:
+    after = json.dumps([task.created_at.isoformat(), task.id])
+    return base64.urlsafe_b64encode(after.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    created_at, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return as_utc(datetime.fromisoformat(created_at)), int(task_id)
+
+
+def as_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    # the database keeps UTC without its timezone, times without one are UTC
+    if moment is None or moment.tzinfo is None:
+        return moment and moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+@app.get(
+    "/tasks",
+    response_model=TaskPage,
+    responses={status.HTTP_400_BAD_REQUEST: {"model": BadError}},
+)
+def get_tasks(
+    current_user: Annotated[User, Depends(get_current_user)],
+    task_status: Annotated[Optional[TaskStatus], Query(alias="status")] = None,
+    model: Annotated[Optional[List[Model]], Query()] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = 50,
+):
+    """The tasks of the user, newest first. ?model= more than once matches
+    tasks chaining those models in that order"""
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except (TypeError, ValueError):
+        return JSONResponse(
+            ResponseErrors.INVALID_CURSOR.value, status.HTTP_400_BAD_REQUEST
+        )
+
+    tasks = list_tasks(
+        current_user.username,
+        status=task_status,
+        model="+".join(name.value for name in model) if model else None,
+        since=as_utc(since),
+        until=as_utc(until),
+        after=after,
+        limit=limit,
+    )
+    return TaskPage(
+        tasks=[
+            TaskSummary(
+                task_id=task.id,
+                job_id=task.job_id,
+                status=task.status,
+                stage=task.stage,
+                model=task.model,
+                width=task.width,
+                height=task.height,
+                created_at=task.created_at,
+                finished_at=task.finished_at,
+            )
+            for task in tasks
+        ],
+        # a full page may be followed by more
+        next_cursor=encode_cursor(tasks[-1]) if len(tasks) == limit else None,
+    )
 
 
 @app.get("/link")
 def get_link(task_id: int, current_user: Annotated[User, Depends(get_current_user)]):
-    task = get_task(task_id)
-    link = {"source_link": "", "output_link": ""}  # to avoid None
-    if task:
-        if task.uploaded_to == "s3":
-            link["source_link"] = f"https://{S3_BUCKET}.s3.amazonaws.com/{task.source}"
-            link["output_link"] = f"https://{S3_BUCKET}.s3.amazonaws.com/{task.output}"
-        elif task.uploaded_to == "local":
-            link["source_link"] = f"/static/{task.source}"
-            link["output_link"] = f"/static/{task.output}"
+    return task_links(task_id)
+
+
+def unique_filename(file: IngestedFile) -> str:
+    if file.filename:
+        return f"{Path(file.filename).stem}_{uuid.uuid4()}"
+    return str(uuid.uuid4())
+
+
+def admit_file(file: IngestedFile) -> Optional[Admission]:
+    """None when the header of the file doesn't tell the size of the image"""
+    dimensions = file.dimensions()
+    if not dimensions:
+        return None
+    return admit(*dimensions)
+
+
+def admitted_task(admission: Admission, content_hash: str, **fields) -> Task:
+    scale = admission.scale if admission.decision == Decision.DOWNSCALE else None
+    if scale is not None:
+        # the smaller result mustn't be served from the cache to an identical
+        # upload which fits, only to one downscaled the same way
+        content_hash = f"{content_hash}@{scale:.6g}"
+    return Task(
+        width=admission.width,
+        height=admission.height,
+        admission=admission.decision.value,
+        memory_estimate=admission.estimate,
+        scale=scale,
+        content_hash=content_hash,
+        **fields,
+    )
+
 
-    return link
+def image_too_large(admission: Admission) -> JSONResponse:
+    return JSONResponse(
+        {
+            **ResponseErrors.IMAGE_TOO_LARGE.value,
+            "data": {"admission": admission.as_dict()},
+        },
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    )
 
 
 @app.post(
@@ -153,68 +584,395 @@ def get_link(task_id: int, current_user: Annotated[User, Depends(get_current_use
     responses={
         status.HTTP_400_BAD_REQUEST: {"model": BadError},
         status.HTTP_406_NOT_ACCEPTABLE: {"model": Error},
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE: {"model": Error},
+        status.HTTP_503_SERVICE_UNAVAILABLE: {"model": Error},
     },
+    openapi_extra=UPLOAD_REQUEST_BODY,
 )
 async def clean_image(
-    file: UploadFile,
-    model: Model,
-    background_tasks: BackgroundTasks,
+    request: Request,
+    model: Annotated[List[Model], Query()],
     response: Response,
     current_user: Annotated[User, Depends(get_current_user)],
+    priority: int = 0,
+    precision: Optional[Precision] = None,
+    image_format: Annotated[Optional[ImageFormat], Query(alias="format")] = None,
+    preview: bool = False,
 ):
-    with open("state.json", "r") as jf:
-        state = AppState.model_validate_json(jf.read())
-        if state.status != "finished":
-            return JSONResponse(
-                ResponseErrors.ALREADY_PROCESSING.value, status.HTTP_406_NOT_ACCEPTABLE
-            )
+    if len(model) > MAX_CHAINED_MODELS:
+        return JSONResponse(
+            ResponseErrors.TOO_MANY_MODELS.value, status.HTTP_400_BAD_REQUEST
+        )
 
-    if file.size:
-        if file.size > MAX_FILE_SIZE * 1024:
-            return JSONResponse(
-                ResponseErrors.BIG_FILE_SIZE.value, status.HTTP_406_NOT_ACCEPTABLE
+    max_size = MAX_FILE_SIZE * 1024
+    precision = precision or PRECISION
+    models = [name.value for name in model]
+    # a single fp32 model keeps the hashes results were cached under before
+    # chains and precisions existed
+    cache_key = "+".join(models)
+    if precision != Precision.FP32:
+        cache_key = f"{cache_key}:{precision.value}"
+    if image_format:
+        cache_key = f"{cache_key}.{image_format.value}"
+
+    def new_file(field, filename):
+        if field != "file":
+            return None
+        return IngestedFile(filename, cache_key, max_size, ALLOWED_FILE_TYPES)
+
+    try:
+        files = await ingest(
+            request.headers.get("content-type", ""),
+            int(request.headers.get("content-length") or 0) or None,
+            request.stream(),
+            new_file,
+            max_size,
+        )
+    except UploadTooLarge:
+        return JSONResponse(
+            ResponseErrors.BIG_FILE_SIZE.value, status.HTTP_406_NOT_ACCEPTABLE
+        )
+    except InvalidContent:
+        return JSONResponse(
+            ResponseErrors.INVALID_CONTENT.value, status.HTTP_406_NOT_ACCEPTABLE
+        )
+
+    def pending(running):
+        return JSONResponse(
+            Success(
+                details="Pending",
+                data={"taskId": running, "queuePosition": jobs.position(running)},
+            ).model_dump(),
+            status.HTTP_202_ACCEPTED,
+        )
+
+    # the database, the cache lookups and moving the file block, so they run
+    # in a thread instead of on the event loop
+    def schedule():
+        if files and files[0].size:
+            file = files[0]
+            for extra in files[1:]:
+                extra.discard()
+            ext = image_format.value if image_format else file.format
+            key = file.digest
+
+            cached = get_finished_task_by_hash(key)
+            if cached:
+                file.discard()
+                cache_stats.hits += 1
+                return JSONResponse(
+                    Success(
+                        details="Finished", data={"taskId": cached.id, "cached": True}
+                    ).model_dump(),
+                    status.HTTP_200_OK,
+                )
+
+            running = in_flight.get(key)
+            if running and QUEUE_BACKEND == "database":
+                # worker.py processes only release the tasks they ran in their own
+                task = get_task(running)
+                if not task or task.status in (TaskStatus.FINISHED, TaskStatus.FAILED):
+                    in_flight.release(key, running)
+                    running = None
+            if running:
+                file.discard()
+                cache_stats.in_flight_hits += 1
+                return pending(running)
+            cache_stats.misses += 1
+
+            admission = admit_file(file)
+            if not admission:
+                file.discard()
+                return JSONResponse(
+                    ResponseErrors.INVALID_CONTENT.value, status.HTTP_406_NOT_ACCEPTABLE
+                )
+            if admission.decision == Decision.REJECT:
+                file.discard()
+                return image_too_large(admission)
+
+            if jobs.depth >= jobs.max_size:
+                file.discard()
+                return JSONResponse(
+                    ResponseErrors.QUEUE_FULL.value, status.HTTP_503_SERVICE_UNAVAILABLE
+                )
+
+            filename = unique_filename(file)
+
+            source = f"{filename}.{file.format}"
+            destination = f"{filename}_processed.{ext}"
+
+            task = admitted_task(
+                admission,
+                source=source,
+                output=destination,
+                preview=f"{filename}_preview.{ext}" if preview else None,
+                content_hash=key,
+                owner=current_user.username,
+                model="+".join(models),
             )
 
-        if not file.content_type:
+            with new_session() as session:
+                session.add(task)
+                session.commit()
+                task_id = task.id
+            # downscaled tasks have a key of their own, see admitted_task
+            key = task.content_hash
+
+            position = None
+            if task_id:
+                owner = in_flight.claim(key, task_id)
+                if owner != task_id:
+                    # an identical upload got in between the check above and here
+                    delete_task(task_id)
+                    file.discard()
+                    cache_stats.misses -= 1
+                    cache_stats.in_flight_hits += 1
+                    return pending(owner)
+                file.move_to(LOCAL_BUCKET / source)
+
+                try:
+                    position = jobs.submit(
+                        task_id, models, precision.value, priority=priority
+                    )
+                except QueueFull:
+                    in_flight.release(key, task_id)
+                    # the task would stay pending forever, nothing is going to run it
+                    set_task_status(task_id, TaskStatus.FAILED)
+                    try:
+                        (LOCAL_BUCKET / source).unlink()
+                    except FileNotFoundError:
+                        pass
+                    return JSONResponse(
+                        ResponseErrors.QUEUE_FULL.value,
+                        status.HTTP_503_SERVICE_UNAVAILABLE,
+                    )
+                set_task_status(task_id, TaskStatus.SCHEDULED)
+
             return JSONResponse(
-                ResponseErrors.INVALID_CONTENT.value, status.HTTP_406_NOT_ACCEPTABLE
+                Success(
+                    details="Pending",
+                    data={
+                        "taskId": task_id,
+                        "queuePosition": position,
+                        "admission": admission.as_dict(),
+                    },
+                ).model_dump(),
+                status.HTTP_202_ACCEPTED,
             )
 
-        ext = file.content_type.split("/")[1]
+        for file in files:
+            file.discard()
+        return JSONResponse(
+            ResponseErrors.INVALID_CONTENT.value, status.HTTP_400_BAD_REQUEST
+        )
+
+    return await run_in_threadpool(schedule)
 
-        if ext not in ALLOWED_FILE_TYPES:
+
+@app.post(
+    "/bulk",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=Success,
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"model": BadError},
+        status.HTTP_406_NOT_ACCEPTABLE: {"model": Error},
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE: {"model": Error},
+        status.HTTP_503_SERVICE_UNAVAILABLE: {"model": Error},
+    },
+    openapi_extra=BULK_REQUEST_BODY,
+)
+async def clean_images_in_bulk(
+    request: Request,
+    model: Annotated[List[Model], Query()],
+    current_user: Annotated[User, Depends(get_current_user)],
+    priority: int = 0,
+    precision: Optional[Precision] = None,
+    image_format: Annotated[Optional[ImageFormat], Query(alias="format")] = None,
+):
+    if len(model) > MAX_CHAINED_MODELS:
+        return JSONResponse(
+            ResponseErrors.TOO_MANY_MODELS.value, status.HTTP_400_BAD_REQUEST
+        )
+
+    max_file_size = MAX_FILE_SIZE * 1024
+    precision = precision or PRECISION
+    models = [name.value for name in model]
+    cache_key = "+".join(models)
+    if precision != Precision.FP32:
+        cache_key = f"{cache_key}:{precision.value}"
+    if image_format:
+        cache_key = f"{cache_key}.{image_format.value}"
+
+    def new_part(field, filename):
+        if field not in ("file", "files"):
+            return None
+        return IngestedFile(
+            filename, cache_key, MAX_BULK_SIZE * 1024, ALLOWED_FILE_TYPES + ["zip"]
+        )
+
+    def new_member(filename):
+        return IngestedFile(filename, cache_key, max_file_size, ALLOWED_FILE_TYPES)
+
+    try:
+        parts = await ingest(
+            request.headers.get("content-type", ""),
+            int(request.headers.get("content-length") or 0) or None,
+            request.stream(),
+            new_part,
+            MAX_BULK_SIZE * 1024,
+        )
+    except UploadTooLarge:
+        return JSONResponse(
+            ResponseErrors.BIG_FILE_SIZE.value, status.HTTP_406_NOT_ACCEPTABLE
+        )
+    except InvalidContent:
+        return JSONResponse(
+            ResponseErrors.INVALID_CONTENT.value, status.HTTP_406_NOT_ACCEPTABLE
+        )
+
+    # extracting, hashing, the database and moving the files block, so they
+    # run in a thread instead of on the event loop
+    def schedule():
+        files: List[IngestedFile] = []
+        rejected: List[str] = []
+        try:
+            for part in parts:
+                if part.format == "zip":
+                    try:
+                        extracted, skipped = extract_zip(
+                            part.path, new_member, MAX_BULK_FILES - len(files)
+                        )
+                    finally:
+                        part.discard()
+                    files += extracted
+                    rejected += skipped
+                elif (
+                    part.size
+                    and part.size <= max_file_size
+                    and len(files) < MAX_BULK_FILES
+                ):
+                    files.append(part)
+                else:
+                    part.discard()
+                    rejected.append(part.filename or "")
+        except InvalidContent:
+            for file in files + parts:
+                file.discard()
             return JSONResponse(
                 ResponseErrors.INVALID_CONTENT.value, status.HTTP_406_NOT_ACCEPTABLE
             )
 
-        filename = str(uuid.uuid4())
-        if file.filename:
-            filepath = Path(file.filename)
-            filename = f"{filepath.stem}_{uuid.uuid4()}"
-
-        source = f"{filename}.{ext}"
-        destination = f"{filename}_processed.{ext}"
-
-        task = Task(source=source, output=destination)
+        if not files:
+            return JSONResponse(
+                ResponseErrors.INVALID_CONTENT.value, status.HTTP_400_BAD_REQUEST
+            )
+        if jobs.depth >= jobs.max_size:
+            for file in files:
+                file.discard()
+            return JSONResponse(
+                ResponseErrors.QUEUE_FULL.value, status.HTTP_503_SERVICE_UNAVAILABLE
+            )
 
-        with Session(engine) as session:
-            session.add(task)
-            session.commit()
-            session.refresh(task)
-            task_id = task.id
+        cached = get_finished_tasks_by_hashes(file.digest for file in files)
+        now = datetime.now(timezone.utc)
+        tasks, scheduled = [], []
+        decisions = Counter()
+        too_large = None
+        for file in files:
+            hit = cached.get(file.digest)
+            if hit:
+                # the result is shared with the task which made it
+                file.discard()
+                cache_stats.hits += 1
+                tasks.append(
+                    Task(
+                        source=hit.source,
+                        output=hit.output,
+                        uploaded_to=hit.uploaded_to,
+                        output_uploaded_to=hit.output_uploaded_to,
+                        content_hash=file.digest,
+                        owner=current_user.username,
+                        model="+".join(models),
+                        status=TaskStatus.FINISHED,
+                        stage=TaskStage.FULL,
+                        finished_at=now,
+                    )
+                )
+                continue
+            cache_stats.misses += 1
+            admission = admit_file(file)
+            if not admission or admission.decision == Decision.REJECT:
+                file.discard()
+                rejected.append(file.filename or "")
+                too_large = admission or too_large
+                continue
+            decisions[admission.decision.value] += 1
+            filename = unique_filename(file)
+            output_format = image_format.value if image_format else file.format
+            task = admitted_task(
+                admission,
+                source=f"{filename}.{file.format}",
+                output=f"{filename}_processed.{output_format}",
+                content_hash=file.digest,
+                owner=current_user.username,
+                model="+".join(models),
+                status=TaskStatus.SCHEDULED,
+                queued_at=now,
+            )
+            tasks.append(task)
+            scheduled.append((task, file))
 
-        if task_id:
-            update_task_status(task_id, TaskStatus.PENDING)
-            data = await file.read()
-            upload_to_local(source, data)
+        if not tasks:
+            if too_large:
+                return image_too_large(too_large)
+            return JSONResponse(
+                ResponseErrors.INVALID_CONTENT.value, status.HTTP_406_NOT_ACCEPTABLE
+            )
 
-            background_tasks.add_task(clean_image_concurrently, task_id, model.value)
+        job = create_job(tasks)
+        for task, file in scheduled:
+            file.move_to(LOCAL_BUCKET / task.source)
+            in_flight.claim(task.content_hash, task.id)
+
+        position = None
+        if scheduled:
+            try:
+                position = jobs.submit(
+                    job_key(job.id),
+                    job.id,
+                    models,
+                    precision.value,
+                    priority=priority,
+                    handler="job",
+                )
+            except QueueFull:
+                # the cached tasks of the job are finished already
+                update_job_status(job.id, TaskStatus.FAILED)
+                for task, _ in scheduled:
+                    in_flight.release(task.content_hash, task.id)
+                    set_task_status(task.id, TaskStatus.FAILED)
+                    try:
+                        (LOCAL_BUCKET / task.source).unlink()
+                    except FileNotFoundError:
+                        pass
+                return JSONResponse(
+                    ResponseErrors.QUEUE_FULL.value, status.HTTP_503_SERVICE_UNAVAILABLE
+                )
 
         return JSONResponse(
-            Success(details="Pending", data={"taskId": task_id}).model_dump(),
-            status.HTTP_202_ACCEPTED,
+            Success(
+                details="Pending" if scheduled else "Finished",
+                data={
+                    "jobId": job.id,
+                    "tasks": len(tasks),
+                    "cached": len(tasks) - len(scheduled),
+                    "rejected": rejected,
+                    "queuePosition": position,
+                    # number of the scheduled tasks by admission decision
+                    "admission": decisions,
+                },
+            ).model_dump(),
+            status.HTTP_202_ACCEPTED if scheduled else status.HTTP_200_OK,
         )
 
-    return JSONResponse(
-        ResponseErrors.INVALID_CONTENT.value, status.HTTP_400_BAD_REQUEST
-    )
+    return await run_in_threadpool(schedule)
@@ -1,2 +1,10 @@
 from .models import *
-from .clean import clean_image
+
+
+def __getattr__(name):
+    # model.clean imports torch, it's only loaded once something asks for it
+    if name == "clean_image":
+        from .clean import clean_image
+
+        return clean_image
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,161 @@
+"""Admission of images by the memory their restoration would take.
+
+The estimate only needs the dimensions from the header of the image. The
+forward of Restormer allocates about the same number of bytes for every
+pixel it's given whatever the precision, tiling bounds that to the
+pixels of one batch of tiles, and the whole image is kept a few times
+around it.
+"""
+import math
+import threading
+from contextlib import contextmanager
+from enum import Enum
+from typing import Callable, Optional
+
+# peak bytes allocated by the forward per padded input pixel, measured on
+# 256px and 384px inputs with resource.getrusage around the forward
+FORWARD_BYTES_PER_PIXEL = {"reference": 9000, "fast": 8500}
+
+# the float input, output and blending weights kept for the whole image,
+# and the uint8 image before and after
+IMAGE_BYTES_PER_PIXEL = 3 * 4 + 3 * 4 + 4 + 3 + 3
+
+# images aren't downscaled below this share of their width and height
+MIN_SCALE = 0.125
+
+
+class Decision(str, Enum):
+    ACCEPT = "accept"
+    QUEUE = "queue"
+    DOWNSCALE = "downscale"
+    REJECT = "reject"
+
+
+class Admission:
+    def __init__(
+        self,
+        decision: Decision,
+        width: int,
+        height: int,
+        estimate: int,
+        scale: float = 1.0,
+    ):
+        self.decision = decision
+        self.width = width
+        self.height = height
+        self.estimate = estimate
+        self.scale = scale
+
+    def as_dict(self):
+        return {
+            "decision": self.decision.value,
+            "width": self.width,
+            "height": self.height,
+            "memoryEstimate": self.estimate,
+            "scale": self.scale,
+        }
+
+
+def padded(size: int, multiple_of: int) -> int:
+    return -(-size // multiple_of) * multiple_of
+
+
+def estimate_memory(
+    width: int,
+    height: int,
+    execution: str,
+    tile: int = 0,
+    tile_batch: int = 1,
+    multiple_of: int = 8,
+    bytes_per_pixel: Optional[int] = None,
+) -> int:
+    """Peak bytes restoring a ``width`` x ``height`` image allocates"""
+    H, W = padded(height, multiple_of), padded(width, multiple_of)
+    forward_pixels = H * W
+    # forward runs tiles of the multiple of 8 at or below the tile size
+    tile = tile // multiple_of * multiple_of
+    if tile and (H > tile or W > tile):
+        forward_pixels = min(tile, H) * min(tile, W) * tile_batch
+    bytes_per_pixel = bytes_per_pixel or FORWARD_BYTES_PER_PIXEL.get(execution, max(FORWARD_BYTES_PER_PIXEL.values()))
+    return forward_pixels * bytes_per_pixel + H * W * IMAGE_BYTES_PER_PIXEL
+
+
+class MemoryGate:
+    """Inference memory shared by the images which are restored at once.
+
+    Every restoration reserves its estimate before it starts and waits
+    until enough of ``capacity`` is free. An estimate above the capacity
+    reserves all of it, so it runs on its own.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.reserved = 0
+        self._condition = threading.Condition()
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.reserved
+
+    @contextmanager
+    def reserve(self, nbytes: int):
+        nbytes = min(max(0, nbytes), self.capacity)
+        with self._condition:
+            self._condition.wait_for(lambda: self.reserved + nbytes <= self.capacity)
+            self.reserved += nbytes
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.reserved -= nbytes
+                self._condition.notify_all()
+
+    def admit(
+        self,
+        width: int,
+        height: int,
+        estimate: Callable[[int, int], int],
+        max_pixels: int,
+        downscale: bool,
+    ) -> Admission:
+        """Decide what to do with an image of ``width`` x ``height``.
+
+        It's accepted when its estimate fits in the free memory, queued
+        when it only fits once other restorations are done, downscaled
+        until it fits in the whole capacity when ``downscale`` is set and
+        rejected otherwise. Images over ``max_pixels`` are always rejected,
+        decoding them alone takes too much memory.
+        """
+        needed = estimate(width, height)
+        if width * height > max_pixels:
+            return Admission(Decision.REJECT, width, height, needed)
+        if needed <= self.free:
+            return Admission(Decision.ACCEPT, width, height, needed)
+        if needed <= self.capacity:
+            return Admission(Decision.QUEUE, width, height, needed)
+        if downscale:
+            # the estimate grows with the pixels, so it's about the square of
+            # the scale, the loop corrects for the padding and fixed parts
+            scale = math.sqrt(self.capacity / needed)
+            while scale >= MIN_SCALE:
+                scaled = estimate(*scaled_size(width, height, scale))
+                if scaled <= self.capacity:
+                    return Admission(Decision.DOWNSCALE, width, height, scaled, scale)
+                scale *= 0.9
+        return Admission(Decision.REJECT, width, height, needed)
+
+
+def scaled_size(width: int, height: int, scale: float):
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def available_memory() -> Optional[int]:
+    """MemAvailable from /proc/meminfo, None where there's no procfs"""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
@@ -0,0 +1,313 @@
+"""Tunes the workers, threads, batching and pinning of inference to this machine.
+
+    python -m model.autotune                                  # writes tuning.json
+    python -m model.autotune --resolutions 256,512 --duration 10 --max-latency 3000
+
+Every configuration runs Restormer on random images in as many processes
+at once as it has workers, each with its threads and its share of the
+cores when it's pinned, and reports the throughput and the latency. The
+configuration with the best throughput over the resolutions, of the ones
+within --max-latency, is written to RESTORMER_TUNING_PROFILE, which
+model.settings takes its defaults from at startup. Settings in the
+environment still win over the profile.
+
+Several workers run as the process backend, one worker which batches as
+the thread backend with its batchers, since the worker processes take
+one image at a time.
+"""
+import argparse
+import json
+import math
+import multiprocessing as mp
+import queue
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from .topology import PINNINGS, cpu_sets, machine, physical_cores, pin
+
+# in milliseconds, the batch window a profile which batches runs with
+PROFILE_BATCH_WINDOW = 10.0
+
+
+class Configuration(NamedTuple):
+    workers: int
+    # per worker, 0 leaves torch to pick them
+    threads: int
+    batch: int
+    pinning: str
+
+    def __str__(self):
+        threads = self.threads or "default"
+        return f"workers={self.workers} threads={threads} batch={self.batch} pinning={self.pinning}"
+
+
+def load_profile(path: str) -> Dict:
+    """The settings of the profile at ``path``, none when there's no profile
+    or it was tuned on another machine"""
+    try:
+        with open(path) as file:
+            profile = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Ignoring the tuning profile {path}: {e}")
+        return {}
+    if profile.get("machine") != machine():
+        print(f"Ignoring the tuning profile {path}, it was tuned on another machine")
+        return {}
+    return profile.get("settings", {})
+
+
+def profile_settings(config: Configuration) -> Dict:
+    """The settings the service runs ``config`` with"""
+    if config.workers > 1:
+        return {
+            "backend": "process",
+            "processes": config.workers,
+            # one task per process keeps all of them busy
+            "workers": config.workers,
+            "threads": config.threads,
+            "pinning": config.pinning,
+        }
+    settings = {
+        "backend": "thread",
+        # the batchers can only fill a batch from as many tasks as run at once
+        "workers": config.batch,
+        "threads": config.threads,
+        "pinning": config.pinning,
+    }
+    if config.batch > 1:
+        settings.update(batch=config.batch, batch_window=PROFILE_BATCH_WINDOW)
+    return settings
+
+
+def _powers_of_two(limit: int) -> List[int]:
+    return sorted({2 ** i for i in range(int(math.log2(limit)) + 1)} | {limit})
+
+
+def configurations(
+    cores: int,
+    smt: bool,
+    workers: Optional[List[int]] = None,
+    threads: Optional[List[int]] = None,
+    batches: Optional[List[int]] = None,
+    pinnings: Optional[List[str]] = None,
+) -> Iterator[Configuration]:
+    """Configurations which don't run more threads than there are cores,
+    and one per worker count with torch's default threads to compare with"""
+    pinnings = pinnings or ["none", "cores"] + (["smt"] if smt else [])
+    for count in workers or _powers_of_two(cores):
+        # every worker with an even share of the cores, or half of it
+        per_worker = threads or sorted({max(1, cores // count), max(1, cores // count // 2)})
+        for thread_count in [0] + [t for t in per_worker if t and count * t <= cores]:
+            for batch in batches or [1, 2, 4]:
+                if batch > 1 and count > 1:
+                    continue
+                for pinning in pinnings:
+                    if pinning != "none" and not thread_count:
+                        continue
+                    yield Configuration(count, thread_count, batch, pinning)
+
+
+def _load(model: str, precision: str):
+    from .checkpoints import flat_path
+    from .clean import load_model, parameters, restormer_arch
+    from .models import MODEL_PATHS
+    from .precision import apply_precision
+    from .restormer_fast import optimize
+    from .settings import EXECUTION
+
+    path = MODEL_PATHS[model]
+    if path.exists() or flat_path(path).exists():
+        return load_model(path, precision)
+    # random weights take as long as trained ones
+    net = restormer_arch()["Restormer"](**parameters).eval()
+    if EXECUTION == "fast":
+        optimize(net)
+    return apply_precision(net, precision)
+
+
+def _measure(cpus, threads, model, precision, resolution, batch, duration, barrier, results):
+    # before torch starts its threads, so they inherit the affinity
+    if cpus:
+        pin(cpus)
+    import numpy as np
+    import torch
+
+    from .clean import pad_input, to_tensor
+
+    if threads:
+        torch.set_num_threads(threads)
+    try:
+        net = _load(model, precision)
+        image = np.random.default_rng(0).integers(0, 256, (resolution, resolution, 3), np.uint8)
+        input_ = pad_input(to_tensor(image))[0].repeat(batch, 1, 1, 1)
+        with torch.no_grad():
+            net(input_)
+            barrier.wait()
+            latencies = []
+            start = time.perf_counter()
+            while time.perf_counter() - start < duration:
+                began = time.perf_counter()
+                net(input_)
+                latencies.append(time.perf_counter() - began)
+            results.put((len(latencies) * batch, time.perf_counter() - start, latencies))
+    except Exception as e:
+        barrier.abort()
+        results.put(e)
+
+
+def measure(config: Configuration, model: str, precision: str, resolution: int, duration: float) -> Dict:
+    """Throughput and latency of ``config`` restoring ``resolution`` px images"""
+    context = mp.get_context("spawn")
+    barrier = context.Barrier(config.workers)
+    results = context.Queue()
+    sets = cpu_sets(config.workers, config.threads, config.pinning) or [None] * config.workers
+    processes = [
+        context.Process(
+            target=_measure,
+            args=(cpus, config.threads, model, precision, resolution, config.batch, duration, barrier, results),
+            daemon=True,
+        )
+        for cpus in sets
+    ]
+    for process in processes:
+        process.start()
+    measured = []
+    try:
+        for _ in processes:
+            # loading the model and the first forward come before the duration
+            result = results.get(timeout=duration * 4 + 300)
+            if isinstance(result, Exception):
+                return {"error": repr(result)}
+            measured.append(result)
+    except queue.Empty:
+        return {"error": "timed out"}
+    finally:
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+    images = sum(count for count, _, _ in measured)
+    elapsed = max(seconds for _, seconds, _ in measured)
+    latency = summarise([seconds for _, _, latencies in measured for seconds in latencies])
+    return {
+        "throughput": images / elapsed,
+        "megapixelsPerSecond": images * resolution * resolution / elapsed / 1e6,
+        "latency": latency,
+    }
+
+
+def summarise(samples: List[float]) -> Dict[str, float]:
+    import numpy as np
+
+    return {
+        "p50": float(np.percentile(samples, 50)),
+        "p95": float(np.percentile(samples, 95)),
+        "mean": float(np.mean(samples)),
+    }
+
+
+def fits(config: Configuration, resolution: int) -> bool:
+    from .admission import available_memory, estimate_memory
+    from .settings import EXECUTION
+
+    available = available_memory()
+    if not available:
+        return True
+    needed = estimate_memory(resolution, resolution * config.batch, EXECUTION) * config.workers
+    return needed < available * 0.9
+
+
+def best(results: List[Dict], max_latency: Optional[float]) -> Optional[Dict]:
+    """The result with the highest geometric mean of megapixels per second
+    over the resolutions, of the ones which are within ``max_latency`` at
+    all of them if there are any"""
+    complete = [r for r in results if all("error" not in m for m in r["resolutions"].values())]
+    if max_latency:
+        within = [
+            r
+            for r in complete
+            if all(m["latency"]["p95"] * 1000 <= max_latency for m in r["resolutions"].values())
+        ]
+        if not within:
+            print(f"No configuration is within {max_latency}ms, picking the fastest")
+        complete = within or complete
+
+    def score(result):
+        rates = [m["megapixelsPerSecond"] for m in result["resolutions"].values()]
+        return math.exp(sum(math.log(rate) for rate in rates) / len(rates))
+
+    return max(complete, key=score, default=None)
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    from .models import Model, Precision
+    from .settings import EXECUTION, PRECISION, TUNING_PROFILE
+
+    cores = physical_cores()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=Model.DERAIN.value, choices=[m.value for m in Model])
+    parser.add_argument("--precision", default=PRECISION.value, choices=[p.value for p in Precision])
+    parser.add_argument("--resolutions", type=int_list, default=[256, 512])
+    parser.add_argument("--workers", type=int_list, help="powers of two up to the cores by default")
+    parser.add_argument("--threads", type=int_list, help="per worker, its share of the cores and half of it by default")
+    parser.add_argument("--batch-sizes", type=int_list)
+    parser.add_argument("--pinnings", type=lambda value: value.split(","), help=f"of {', '.join(PINNINGS)}")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds every configuration runs for")
+    parser.add_argument("--max-latency", type=float, help="in ms, the p95 the profile has to stay within")
+    parser.add_argument("--output", default=TUNING_PROFILE)
+    args = parser.parse_args(argv)
+
+    smt = any(len(siblings) > 1 for siblings in cores)
+    configs = list(
+        configurations(len(cores), smt, args.workers, args.threads, args.batch_sizes, args.pinnings)
+    )
+    print(f"Trying {len(configs)} configurations on {len(cores)} cores at {args.resolutions}px")
+
+    results = []
+    for config in configs:
+        result = {**config._asdict(), "resolutions": {}}
+        for resolution in args.resolutions:
+            if not fits(config, resolution):
+                measured = {"error": "doesn't fit in memory"}
+            else:
+                measured = measure(config, args.model, args.precision, resolution, args.duration)
+            result["resolutions"][str(resolution)] = measured
+            if "error" in measured:
+                print(f"{config} {resolution}px: {measured['error']}")
+                continue
+            latency = measured["latency"]
+            print(
+                f"{config} {resolution}px: {measured['throughput']:.2f} images/s"
+                f" p50 {latency['p50'] * 1000:.0f}ms p95 {latency['p95'] * 1000:.0f}ms"
+            )
+        results.append(result)
+
+    chosen = best(results, args.max_latency)
+    if chosen is None:
+        raise SystemExit("No configuration ran, nothing to write")
+    config = Configuration(*(chosen[field] for field in Configuration._fields))
+    profile = {
+        "machine": machine(),
+        "tunedAt": datetime.now(timezone.utc).isoformat(),
+        "model": args.model,
+        "precision": args.precision,
+        "execution": EXECUTION,
+        "best": str(config),
+        "settings": profile_settings(config),
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(profile, output, indent=2)
+    print(f"Best: {config}, wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
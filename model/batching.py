@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+
+class _Work:
+    def __init__(self, input_: torch.Tensor):
+        self.input = input_
+        self.queued = time.perf_counter()
+        self.done = threading.Event()
+        self.result: Optional[torch.Tensor] = None
+        self.error: Optional[BaseException] = None
+
+
+class BatchStats:
+    def __init__(self):
+        self.batches = 0
+        self.items = 0
+        self.capacity = 0
+        self.wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, size: int, max_batch: int, waits: List[float]):
+        self.batches += 1
+        self.items += size
+        self.capacity += max_batch
+        self.wait += sum(waits)
+        self.max_wait = max(self.max_wait, *waits)
+
+    @property
+    def fill(self) -> float:
+        return self.items / self.capacity if self.capacity else 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        return self.wait / self.items if self.items else 0.0
+
+    def as_dict(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "fill": self.fill,
+            "mean_wait": self.mean_wait,
+            "max_wait": self.max_wait,
+        }
+
+
+class DynamicBatcher:
+    """Collects forwards for one model and runs them as batched forwards.
+
+    Calling the batcher behaves like calling the model: every sample of the
+    input is queued, work arriving within ``window`` seconds of the first
+    queued sample is grouped by shape and run ``max_batch`` samples at a
+    time, and the outputs are handed back to their callers.
+    """
+
+    def __init__(
+        self, get_model: Callable[[], torch.nn.Module], window: float, max_batch: int
+    ):
+        self.get_model = get_model
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.stats = BatchStats()
+        self._queue: "queue.Queue[Optional[_Work]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def __call__(self, input_: torch.Tensor) -> torch.Tensor:
+        self._ensure_started()
+        work = [_Work(sample) for sample in input_.split(1)]
+        for item in work:
+            self._queue.put(item)
+        for item in work:
+            item.done.wait()
+            if item.error is not None:
+                raise item.error
+        return torch.cat([item.result for item in work])
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def _collect(self, first: _Work) -> List[_Work]:
+        batch = [first]
+        deadline = first.queued + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            groups: Dict[torch.Size, List[_Work]] = defaultdict(list)
+            for item in self._collect(first):
+                groups[item.input.shape].append(item)
+
+            for items in groups.values():
+                self._forward(items)
+
+    def _forward(self, items: List[_Work]):
+        started = time.perf_counter()
+        self.stats.record(
+            len(items), self.max_batch, [started - item.queued for item in items]
+        )
+        try:
+            # grad mode is per thread, so it has to be disabled here as well
+            with torch.no_grad():
+                output = self.get_model()(torch.cat([item.input for item in items]))
+            for item, result in zip(items, output.split(1)):
+                item.result = result
+        except BaseException as err:
+            for item in items:
+                item.error = err
+        finally:
+            for item in items:
+                item.done.set()
+
+
+class Batchers:
+    def __init__(self, registry, window: float, max_batch: int):
+        self.registry = registry
+        self.window = window
+        self.max_batch = max_batch
+        self._batchers: Dict[str, DynamicBatcher] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model: str, precision: str) -> DynamicBatcher:
+        key = f"{model}:{precision}"
+        with self._lock:
+            if key not in self._batchers:
+                self._batchers[key] = DynamicBatcher(
+                    lambda: self.registry.get(model, precision),
+                    self.window,
+                    self.max_batch,
+                )
+            return self._batchers[key]
+
+    def stats(self):
+        return {
+            name: batcher.stats.as_dict() for name, batcher in self._batchers.items()
+        }
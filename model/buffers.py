@@ -0,0 +1,49 @@
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+import numpy as np
+
+
+class BufferPool:
+    """uint8 image buffers which are handed back once they've been encoded.
+
+    Restored images of the same shape reuse the same memory instead of
+    allocating a new array each time. At most ``per_shape`` free buffers
+    are kept for every shape, and ``max_bytes`` for all of them, the shapes
+    used least recently are dropped first.
+    """
+
+    def __init__(self, per_shape: int = 2, max_bytes: int = 256 * 1024 * 1024):
+        self.per_shape = per_shape
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._free: "OrderedDict[Tuple[int, ...], List[np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, shape: Tuple[int, ...]) -> np.ndarray:
+        with self._lock:
+            free = self._free.get(tuple(shape))
+            if free:
+                buffer = free.pop()
+                self.nbytes -= buffer.nbytes
+                if not free:
+                    del self._free[tuple(shape)]
+                return buffer
+        return np.empty(shape, np.uint8)
+
+    def put(self, buffer: np.ndarray):
+        if buffer.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            free = self._free.setdefault(buffer.shape, [])
+            self._free.move_to_end(buffer.shape)
+            if len(free) >= self.per_shape:
+                return
+            free.append(buffer)
+            self.nbytes += buffer.nbytes
+            while self.nbytes > self.max_bytes:
+                shape, oldest = next(iter(self._free.items()))
+                self.nbytes -= oldest.pop().nbytes
+                if not oldest:
+                    del self._free[shape]
@@ -0,0 +1,197 @@
+"""Flat checkpoints, which load as memory maps.
+
+``torch.load`` reads every tensor of a ``.pth`` into memory of its own, so
+every worker process holds a private copy of the weights of every model.
+A flat checkpoint is the state dict laid out as raw tensor data behind a
+JSON header. The loader maps the file copy-on-write and the parameters of
+the model point straight into the mapping, so the processes share the
+page cache copy of the file, and nothing is read until it's used.
+
+Convert the checkpoints of ``pretrained_models`` once with:
+
+    python -m model.checkpoints                    # every model there is
+    python -m model.checkpoints derain --channels-last
+
+``--channels-last`` lays out the convolution weights the way
+``RESTORMER_EXECUTION=fast`` uses them, which it does by default when
+that's the execution in the environment.
+"""
+import argparse
+import inspect
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from .models import MODEL_PATHS
+
+MAGIC = b"RSTFLAT1"
+# tensor data starts on multiples of it, so the mapped arrays are aligned
+ALIGNMENT = 64
+SUFFIX = ".flat"
+
+# torch >= 2.1 takes the tensors of a state dict as they are with assign=True
+ASSIGN = "assign" in inspect.signature(nn.Module.load_state_dict).parameters
+
+
+def flat_path(model_path: Path) -> Path:
+    return model_path.with_suffix(SUFFIX)
+
+
+def source_stamp(path: Path) -> Dict[str, int]:
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _storage_order(tensor: torch.Tensor) -> torch.Tensor:
+    """``tensor`` permuted so its elements are in the order of its memory"""
+    order = sorted(range(tensor.dim()), key=lambda dim: -tensor.stride(dim))
+    return tensor.permute(*order)
+
+
+def save_flat(
+    state: Dict[str, torch.Tensor],
+    path: Path,
+    source: Optional[Dict[str, int]] = None,
+    channels_last: bool = False,
+):
+    tensors, arrays = {}, []
+    offset = 0
+    for name, tensor in state.items():
+        tensor = tensor.detach().cpu()
+        if channels_last and tensor.dim() == 4:
+            tensor = tensor.contiguous(memory_format=torch.channels_last)
+        else:
+            tensor = tensor.contiguous()
+        array = np.ascontiguousarray(_storage_order(tensor).numpy())
+        offset = _aligned(offset)
+        tensors[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(tensor.shape),
+            "strides": list(tensor.stride()),
+            "offset": offset,
+        }
+        arrays.append((offset, array))
+        offset += array.nbytes
+    size = offset
+
+    header = json.dumps({"source": source, "tensors": tensors}).encode()
+    start = _aligned(len(MAGIC) + 8 + len(header))
+    # loaders mapping the file while it's converted see the old one until the rename
+    partial = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(partial, "wb") as file:
+        file.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for offset, array in arrays:
+            file.seek(start + offset)
+            file.write(array.tobytes())
+        file.truncate(start + size)
+    os.replace(partial, path)
+
+
+def load_flat(path: Path):
+    """The state dict mapped from the flat checkpoint at ``path`` and its header"""
+    with open(path, "rb") as file:
+        # private pages are only made for the ones which get written to
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    if mapping[: len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} isn't a flat checkpoint")
+    (length,) = struct.unpack("<Q", mapping[len(MAGIC) : len(MAGIC) + 8])
+    header = json.loads(mapping[len(MAGIC) + 8 : len(MAGIC) + 8 + length])
+    start = _aligned(len(MAGIC) + 8 + length)
+
+    state = {}
+    for name, entry in header["tensors"].items():
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        # the arrays keep the mapping open for as long as a tensor uses it
+        array = np.frombuffer(
+            mapping, np.dtype(entry["dtype"]), count, start + entry["offset"]
+        )
+        state[name] = torch.from_numpy(array).as_strided(
+            entry["shape"], entry["strides"]
+        )
+    return state, header
+
+
+def load_checkpoint(model_path: Path, channels_last: bool = False):
+    """The state dict of the model at ``model_path``.
+
+    It's mapped from the flat checkpoint next to it when that was converted
+    from the ``.pth`` as it is now, and read with ``torch.load`` otherwise.
+    """
+    flat = flat_path(model_path)
+    if flat.exists():
+        state, header = load_flat(flat)
+        if not model_path.exists() or header["source"] == source_stamp(model_path):
+            # a layout which doesn't match the execution is copied into one which does
+            return {
+                name: tensor.contiguous(
+                    memory_format=torch.channels_last
+                    if channels_last and tensor.dim() == 4
+                    else torch.contiguous_format
+                )
+                for name, tensor in state.items()
+            }
+        print(f"{flat} is out of date with {model_path.name}, loading that instead")
+    return torch.load(str(model_path.absolute()))["params"]
+
+
+def build_on(factory: Callable[[], nn.Module], state: Dict[str, torch.Tensor]):
+    """Build a model whose parameters are the tensors of ``state``.
+
+    The random initialisation is skipped where the model can be built on
+    the meta device. Either way the parameters end up sharing the memory
+    of ``state`` rather than holding copies of it.
+    """
+    if ASSIGN:
+        with torch.device("meta"):
+            model = factory()
+        model.load_state_dict(state, assign=True)
+        return model
+    model = factory()
+    # checks the names and shapes before the tensors are swapped in
+    model.load_state_dict(state)
+    for name, tensor in [*model.named_parameters(), *model.named_buffers()]:
+        tensor.data = state[name]
+    return model
+
+
+def convert(model_path: Path, channels_last: bool = False) -> Path:
+    checkpoint = torch.load(str(model_path.absolute()), map_location="cpu")
+    flat = flat_path(model_path)
+    save_flat(checkpoint["params"], flat, source_stamp(model_path), channels_last)
+    return flat
+
+
+def main(argv=None):
+    from .settings import EXECUTION
+
+    parser = argparse.ArgumentParser(description="Convert checkpoints to flat ones")
+    parser.add_argument("models", nargs="*", help="all the models there are by default")
+    parser.add_argument("--channels-last", dest="channels_last", action="store_true")
+    parser.add_argument(
+        "--no-channels-last", dest="channels_last", action="store_false"
+    )
+    parser.set_defaults(channels_last=EXECUTION == "fast")
+    args = parser.parse_args(argv)
+
+    for name in args.models or list(MODEL_PATHS):
+        model_path = MODEL_PATHS[name]
+        if not model_path.exists():
+            print(f"{model_path} doesn't exist, skipping {name}")
+            continue
+        flat = convert(model_path, args.channels_last)
+        print(f"Converted {model_path} to {flat}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
-from io import BytesIO
+import os
+from functools import lru_cache
 from pathlib import Path
+from typing import Callable, Optional, Sequence, Union
 
 
 
@@ -7,63 +9,220 @@ from pathlib import Path
 import torch
 import torch.nn.functional as F
 from runpy import run_path
-from skimage import img_as_ubyte
 import cv2
 import numpy as np
-from .models import DEBLUR, DERAIN, DEFOCUS
+from utils.metrics import MODULE_SECONDS, STAGE_SECONDS
+from .admission import scaled_size
+from .batching import Batchers
+from .checkpoints import build_on, load_checkpoint
+from .engines import get_engine
+from .inference import buffers
+from .instrument import instrument
+from .models import ImageFormat, Precision
+from .precision import apply_precision
+from .registry import ModelRegistry, parse_model_list
+from .restormer_fast import optimize
+from .settings import (
+    TILE_SIZE,
+    TILE_OVERLAP,
+    BATCH_WINDOW,
+    MAX_BATCH,
+    BACKEND,
+    WORKER_PROCESSES,
+    EXECUTION,
+    ENGINE,
+    PRECISION,
+    MODULE_TIMING,
+    PREVIEW_SIZE,
+    JPEG_QUALITY,
+    PNG_COMPRESSION,
+    WEBP_QUALITY,
+    MODEL_MEMORY_BUDGET,
+    THREADS,
+    PINNING,
+)
+from .tiling import run_tiled
+from .topology import cpu_sets, pin
+from .workers import InferencePool
 img_multiple_of = 8
 
-def clean(image: Path, model: str):
-    model_path = Path()
-    if model == "derain":
-        model_path = DERAIN
-    elif model == "deblur":
-        model_path = DEBLUR
-    elif model == "defocus":
-        model_path = DEFOCUS
-    model = load_model(model_path)
-    with open(image, 'rb') as image_file:
-        image_bytes = image_file.read()
-    return clean_image(image_bytes, model)
-
-def load_model(model_path: Path):
-    #? Get model weights and parameters
-    parameters = {'inp_channels':3, 'out_channels':3, 'dim':48, 'num_blocks':[4,6,6,8], 'num_refinement_blocks':4, 'heads':[1,2,4,8], 'ffn_expansion_factor':2.66, 'bias':False, 'LayerNorm_type':'WithBias', 'dual_pixel_task':False}
-
-    load_arch = run_path(str(Path(__file__).parent / 'restormer_arch.py'))
-    model = load_arch['Restormer'](**parameters)
+# called with the steps of a restoration done and their total
+Progress = Callable[[int, int], None]
 
+parameters = {'inp_channels':3, 'out_channels':3, 'dim':48, 'num_blocks':[4,6,6,8], 'num_refinement_blocks':4, 'heads':[1,2,4,8], 'ffn_expansion_factor':2.66, 'bias':False, 'LayerNorm_type':'WithBias', 'dual_pixel_task':False}
 
-    checkpoint = torch.load(str(model_path.absolute()))
-    model.load_state_dict(checkpoint['params'])
-    return model
+def clean(image: Path, model: Union[str, Sequence[str]], precision: Optional[str] = None, preview: Optional[Callable[[memoryview], None]] = None, image_format: str = ImageFormat.JPEG, progress: Optional[Progress] = None, scale: Optional[float] = None) -> np.ndarray:
+    """Restore ``image`` with ``model``, or with every model of a list in turn.
 
-def clean_image(input_image: bytes, model) -> BytesIO:
-    with torch.no_grad():
+    A quick downscaled restoration is passed to ``preview`` first, encoded
+    as ``image_format``, when one is given and the image is bigger than
+    ``PREVIEW_SIZE``. ``progress`` is called with the steps of the full
+    restoration done and their total, a step is a tile or a whole image
+    for every model. The result is returned unencoded so it can be
+    encoded off the inference thread. It's written into a buffer from
+    ``buffers``, which should be put back once it has been encoded.
+    Images are resized by ``scale`` first when admission downscaled them.
+    """
+    precision = Precision(precision or PRECISION).value
+    with open(image, 'rb') as image_file:
+        image_bytes = image_file.read()
+    with STAGE_SECONDS.time(stage="decode"):
+        cv2_img = decode_image(image_bytes)
+    if scale and scale != 1:
+        h, w = cv2_img.shape[:2]
+        cv2_img = cv2.resize(cv2_img, scaled_size(w, h, scale), interpolation=cv2.INTER_AREA)
+    if preview and max(cv2_img.shape[:2]) > PREVIEW_SIZE:
+        with STAGE_SECONDS.time(stage="preview"):
+            preview(encode_image(restore_preview(cv2_img, model, precision), image_format))
+    with STAGE_SECONDS.time(stage="forward"):
+        return restore(cv2_img, model, precision, out=buffers.get(cv2_img.shape), progress=progress)
+
+def restore(cv2_img: np.ndarray, model: Union[str, Sequence[str]], precision: str, out: Optional[np.ndarray] = None, progress: Optional[Progress] = None) -> np.ndarray:
+    models = [model] if isinstance(model, str) else list(model)
+    if BACKEND == "process":
+        return pool.run(cv2_img, models, precision, out=out, progress=progress)
+    if BATCH_WINDOW:
+        chain = [batchers.get(name, precision) for name in models]
+        return restore_array(cv2_img, chain, tile_batch=MAX_BATCH, out=out, progress=progress)
+    return restore_array(cv2_img, [registry.get(name, precision) for name in models], out=out, progress=progress)
+
+def restore_preview(cv2_img: np.ndarray, model: Union[str, Sequence[str]], precision: str) -> np.ndarray:
+    h, w = cv2_img.shape[:2]
+    scale = PREVIEW_SIZE / max(h, w)
+    small = cv2.resize(cv2_img, (max(1, round(w*scale)), max(1, round(h*scale))), interpolation=cv2.INTER_AREA)
+    return cv2.resize(restore(small, model, precision), (w, h), interpolation=cv2.INTER_CUBIC)
+
+@lru_cache(maxsize=None)
+def restormer_arch():
+    # a run name which is a valid identifier lets TorchScript serialize the classes
+    return run_path(str(Path(__file__).parent / 'restormer_arch.py'), run_name='restormer_arch')
+
+def load_model(model_path: Path, precision: str = Precision.FP32):
+    def build():
+        #? Get model weights and parameters, mapped from a flat checkpoint when there's one
+        Restormer = restormer_arch()['Restormer']
+        state = load_checkpoint(model_path, channels_last=EXECUTION == "fast")
+        model = build_on(lambda: Restormer(**parameters), state)
         model.eval()
-        np_image = np.frombuffer(input_image, np.uint8)
-        cv2_img = cv2.imdecode(np_image, cv2.IMREAD_COLOR)
-        input_ = torch.from_numpy(cv2_img).float().div(255.).permute(2,0,1).unsqueeze(0)
-
-        h,w = input_.shape[2], input_.shape[3]
-        H,W = ((h+img_multiple_of)//img_multiple_of)*img_multiple_of, ((w+img_multiple_of)//img_multiple_of)*img_multiple_of
-        pad_h = H-h if h%img_multiple_of!=0 else 0
-        pad_w = W-w if w%img_multiple_of!=0 else 0
-        input_ = F.pad(input_, (0,pad_w,0,pad_h), 'reflect')
-
-        restored = model(input_)
-        restored = torch.clamp(restored, 0, 1)
-
-        # Unpad the output
-        restored = restored[:,:,:h,:w]
-
-        restored = restored.permute(0, 2, 3, 1).cpu().detach().numpy()
-        restored = img_as_ubyte(restored[0])
-
-        is_success, buffer = cv2.imencode(".jpg", cv2.cvtColor(restored, cv2.IMREAD_COLOR))
-        io_buf = BytesIO(buffer.tobytes())
-    return io_buf
-
+        if EXECUTION == "fast":
+            optimize(model)
+        # the hooks only run in eager mode, an exported graph doesn't keep them
+        if MODULE_TIMING and engine.name == "eager":
+            instrument(model, MODULE_SECONDS)
+        return apply_precision(model, precision)
+
+    return engine.load(build, model_path, f"{Precision(precision).value}-{EXECUTION}")
+
+engine = get_engine(ENGINE)
+registry = ModelRegistry(load_model, MODEL_MEMORY_BUDGET * 1024 * 1024)
+batchers = Batchers(registry, BATCH_WINDOW / 1000, MAX_BATCH)
+# every worker process gets its threads and its share of the cores
+pool = InferencePool(WORKER_PROCESSES, THREADS, cpu_sets(WORKER_PROCESSES, THREADS, PINNING))
+
+def warm_up():
+    models = parse_model_list(os.getenv("RESTORMER_WARMUP_MODELS", ""))
+    registry.warm_up(models, PRECISION)
+
+def start_inference():
+    if BACKEND == "process":
+        # every worker warms up its own models
+        pool.start()
+    else:
+        if THREADS:
+            torch.set_num_threads(THREADS)
+        cpus = cpu_sets(1, THREADS, PINNING)
+        if cpus:
+            pin(cpus[0])
+        warm_up()
+
+def stop_inference():
+    if BACKEND == "process":
+        pool.stop()
+
+def decode_image(input_image: bytes) -> np.ndarray:
+    np_image = np.frombuffer(input_image, np.uint8)
+    return cv2.imdecode(np_image, cv2.IMREAD_COLOR)
+
+def encoder_params(image_format: str):
+    image_format = ImageFormat.from_extension(image_format)
+    if image_format == ImageFormat.PNG:
+        return ".png", [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    if image_format == ImageFormat.WEBP:
+        return ".webp", [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY]
+    return ".jpg", [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+
+def encode_image(restored: np.ndarray, image_format: str = ImageFormat.JPEG) -> memoryview:
+    # restored is BGR like the decoded input, the view avoids copying the
+    # encoder output again
+    extension, params = encoder_params(image_format)
+    is_success, buffer = cv2.imencode(extension, restored, params)
+    if not is_success:
+        raise ValueError(f"couldn't encode the result as {extension}")
+    return memoryview(buffer)
+
+def clean_image(input_image: bytes, model, tile: Optional[int] = None, tile_overlap: Optional[int] = None, tile_batch: int = 1, image_format: str = ImageFormat.JPEG) -> memoryview:
+    restored = restore_array(decode_image(input_image), model, tile, tile_overlap, tile_batch)
+    return encode_image(restored, image_format)
+
+def restore_array(cv2_img: np.ndarray, model, tile: Optional[int] = None, tile_overlap: Optional[int] = None, tile_batch: int = 1, out: Optional[np.ndarray] = None, progress: Optional[Progress] = None) -> np.ndarray:
+    # a list of models runs back to back on the padded tensor, only the
+    # final result is unpadded and quantized
+    models = model if isinstance(model, (list, tuple)) else [model]
+    with torch.no_grad():
+        input_ = to_tensor(cv2_img)
+        restored, h, w = pad_input(input_)
+        for i, model in enumerate(models):
+            if i:
+                # the next model expects an input in the range of an image
+                restored = torch.clamp(restored, 0, 1)
+            step = None
+            if progress:
+                # every model of the chain takes the same number of steps
+                step = lambda done, total, i=i: progress(i * total + done, len(models) * total)
+            restored = forward(model, restored, tile, tile_overlap, tile_batch, step)
+        restored = clamp_unpad(restored, h, w)
+        return to_ubyte(restored, out)
+
+def to_tensor(cv2_img: np.ndarray) -> torch.Tensor:
+    return torch.from_numpy(cv2_img).float().div(255.).permute(2,0,1).unsqueeze(0)
+
+def pad_input(input_: torch.Tensor):
+    h,w = input_.shape[2], input_.shape[3]
+    H,W = ((h+img_multiple_of)//img_multiple_of)*img_multiple_of, ((w+img_multiple_of)//img_multiple_of)*img_multiple_of
+    pad_h = H-h if h%img_multiple_of!=0 else 0
+    pad_w = W-w if w%img_multiple_of!=0 else 0
+    return F.pad(input_, (0,pad_w,0,pad_h), 'reflect'), h, w
+
+def forward(model, input_: torch.Tensor, tile: Optional[int] = None, tile_overlap: Optional[int] = None, tile_batch: int = 1, progress: Optional[Progress] = None) -> torch.Tensor:
+    tile = TILE_SIZE if tile is None else tile
+    tile_overlap = TILE_OVERLAP if tile_overlap is None else tile_overlap
+    # tiles have to satisfy the same size constraint as the whole image
+    tile = tile // img_multiple_of * img_multiple_of
+
+    if tile and (input_.shape[2] > tile or input_.shape[3] > tile):
+        return run_tiled(model, input_, tile, tile_overlap, tile_batch, progress)
+    restored = model(input_)
+    if progress:
+        progress(1, 1)
+    return restored
+
+def clamp_unpad(restored: torch.Tensor, h: int, w: int) -> torch.Tensor:
+    restored = torch.clamp(restored, 0, 1)
+
+    # Unpad the output
+    return restored[:,:,:h,:w]
+
+def to_ubyte(restored: torch.Tensor, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Round the clamped output into ``out``, a h x w x 3 uint8 array.
+
+    The scaling happens in place on ``restored``, which is consumed, and
+    the cast to uint8 writes straight into ``out`` in its hwc layout.
+    """
+    restored = restored[0].detach().mul_(255).round_()
+    if out is None:
+        out = np.empty((restored.shape[1], restored.shape[2], restored.shape[0]), np.uint8)
+    torch.from_numpy(out).copy_(restored.permute(1, 2, 0))
+    return out
 
 if __name__=="__main__":
     input = Path("input")/"input.jpg"
@@ -71,6 +230,6 @@ if __name__=="__main__":
 
     output.parent.mkdir(exist_ok=True)
     with open(input, "rb") as image:
-        output_image = clean_image(image.read(), load_model(Path("pretrained_models")/"derain.pth"))
+        output_image = clean_image(image.read(), load_model(Path("pretrained_models")/"derain.pth"), image_format=output.suffix)
     with open(output, "wb") as output:
-        output.write(output_image.read())
+        output.write(output_image)
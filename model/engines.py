@@ -0,0 +1,123 @@
+"""Inference engines which turn a Restormer checkpoint into the callable
+``clean_image`` and the batchers run.
+
+- eager runs the ``nn.Module`` as it is
+- torchscript traces and freezes it once, then caches the graph on disk
+  so later loads and worker processes skip the Python module entirely
+
+Exported graphs take any batch size and any H/W which is a multiple of
+``img_multiple_of``, the same as the eager model after ``pad_input``.
+"""
+import hashlib
+import os
+import warnings
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable
+
+import torch
+import torch.nn as nn
+
+from .models import EXPORTED_DIR
+from .registry import model_nbytes
+
+# traced on a small input, the graph itself doesn't depend on the size
+TRACE_SIZE = 64
+
+# the sources the exported graph is built from, a change to any of them
+# invalidates the artifacts on disk
+SOURCES = ("restormer_arch.py", "restormer_fast.py", "precision.py")
+
+
+class UnknownEngine(ValueError):
+    pass
+
+
+class Engine(ABC):
+    name = ""
+
+    @abstractmethod
+    def load(
+        self, build: Callable[[], nn.Module], model_path: Path, variant: str
+    ) -> nn.Module:
+        """Return the model for ``model_path``, built by ``build`` if needed.
+
+        ``variant`` tells apart the builds of the same checkpoint, e.g.
+        different precisions.
+        """
+
+
+class EagerEngine(Engine):
+    name = "eager"
+
+    def load(self, build, model_path, variant):
+        return build()
+
+
+class ExportedModel(nn.Module):
+    """A frozen TorchScript graph together with the size of its weights.
+
+    Freezing turns the parameters into graph constants, so the state dict
+    of the graph is empty and the registry reads ``nbytes`` instead.
+    """
+
+    def __init__(self, graph: torch.jit.ScriptModule, nbytes: int):
+        super().__init__()
+        self.graph = graph
+        self.nbytes = nbytes
+
+    def forward(self, x):
+        return self.graph(x)
+
+
+class TorchScriptEngine(Engine):
+    name = "torchscript"
+
+    def __init__(self, cache_dir: Path = EXPORTED_DIR):
+        self.cache_dir = Path(cache_dir)
+
+    def artifact(self, model_path: Path, variant: str) -> Path:
+        digest = hashlib.sha256(torch.__version__.encode())
+        stat = model_path.stat()
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        for source in SOURCES:
+            digest.update((Path(__file__).parent / source).read_bytes())
+        return self.cache_dir / f"{model_path.stem}-{variant}-{digest.hexdigest()[:12]}.pt"
+
+    def load(self, build, model_path, variant):
+        path = self.artifact(model_path, variant)
+        with warnings.catch_warnings():
+            # newer torch warns that TorchScript is deprecated on every call
+            warnings.simplefilter("ignore", FutureWarning)
+            if path.exists():
+                extra = {"nbytes": ""}
+                graph = torch.jit.load(str(path), _extra_files=extra)
+                return ExportedModel(graph, int(extra["nbytes"] or 0))
+
+            model = build()
+            graph = export(model)
+            nbytes = model_nbytes(model)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # workers exporting the same model at the same time each write
+            # their own file, the last rename wins
+            partial = path.with_suffix(f".{os.getpid()}.tmp")
+            torch.jit.save(graph, str(partial), _extra_files={"nbytes": str(nbytes)})
+            os.replace(partial, path)
+            return ExportedModel(graph, nbytes)
+
+
+def export(model: nn.Module) -> torch.jit.ScriptModule:
+    example = torch.zeros(1, 3, TRACE_SIZE, TRACE_SIZE)
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        graph = torch.jit.trace(model.eval(), example, check_trace=False)
+        return torch.jit.freeze(graph)
+
+
+ENGINES = {engine.name: engine for engine in (EagerEngine, TorchScriptEngine)}
+
+
+def get_engine(name: str) -> Engine:
+    if name not in ENGINES:
+        raise UnknownEngine(f"unknown engine {name!r}, expected one of {', '.join(ENGINES)}")
+    return ENGINES[name]()
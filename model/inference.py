@@ -0,0 +1,91 @@
+"""What the API needs from the inference stack, without importing it.
+
+model.clean brings torch, cv2 and einops with it, which take seconds to
+import. The API goes through this module instead: the stack is imported
+and its models warmed up on a background thread at startup, or by the
+first task which needs it if that comes first.
+"""
+import importlib
+import threading
+import traceback
+from types import ModuleType
+from typing import Optional
+
+from .admission import Admission, MemoryGate, available_memory, estimate_memory
+from .buffers import BufferPool
+from .settings import (
+    BACKEND,
+    BATCH_WINDOW,
+    BUFFER_POOL_MEMORY,
+    BYTES_PER_PIXEL,
+    DOWNSCALE,
+    EXECUTION,
+    INFERENCE_MEMORY,
+    MAX_BATCH,
+    MAX_PIXELS,
+    TILE_SIZE,
+)
+
+buffers = BufferPool(max_bytes=BUFFER_POOL_MEMORY * 1024 * 1024)
+memory = MemoryGate(
+    INFERENCE_MEMORY * 1024 * 1024
+    or (available_memory() or 4096 * 1024 * 1024) * 3 // 4
+)
+
+# set once the stack is imported and its models are warm
+ready = threading.Event()
+# the traceback of the startup when it failed
+error: Optional[str] = None
+
+_stack: Optional[ModuleType] = None
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+
+
+def memory_estimate(width: int, height: int) -> int:
+    tile_batch = MAX_BATCH if BATCH_WINDOW and BACKEND != "process" else 1
+    return estimate_memory(
+        width, height, EXECUTION, TILE_SIZE, tile_batch, bytes_per_pixel=BYTES_PER_PIXEL
+    )
+
+
+def admit(width: int, height: int) -> Admission:
+    return memory.admit(width, height, memory_estimate, MAX_PIXELS, DOWNSCALE)
+
+
+def stack() -> ModuleType:
+    """model.clean, imported the first time it's asked for"""
+    global _stack
+    if _stack is None:
+        with _lock:
+            if _stack is None:
+                _stack = importlib.import_module(".clean", __package__)
+    return _stack
+
+
+def loaded() -> Optional[ModuleType]:
+    """model.clean if it has been imported already"""
+    return _stack
+
+
+def _start():
+    global error
+    try:
+        stack().start_inference()
+        ready.set()
+    except Exception:
+        error = traceback.format_exc()
+        traceback.print_exc()
+
+
+def start():
+    global _thread
+    _thread = threading.Thread(target=_start, name="inference-startup", daemon=True)
+    _thread.start()
+
+
+def stop():
+    if _thread is not None:
+        _thread.join()
+    if _stack is not None:
+        _stack.stop_inference()
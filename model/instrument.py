@@ -0,0 +1,43 @@
+import threading
+import time
+
+import torch
+
+# the stages of the Restormer forward which are made of TransformerBlocks
+STAGES = (
+    "encoder_level1",
+    "encoder_level2",
+    "encoder_level3",
+    "latent",
+    "decoder_level3",
+    "decoder_level2",
+    "decoder_level1",
+    "refinement",
+)
+
+
+def instrument(model: torch.nn.Module, histogram) -> torch.nn.Module:
+    """Time every TransformerBlock stage of ``model`` into ``histogram``.
+
+    The hooks add a little overhead to every forward, so they are only
+    registered when module timing is turned on.
+    """
+    started = threading.local()
+
+    def before(name):
+        def hook(module, inputs):
+            setattr(started, name, time.perf_counter())
+        return hook
+
+    def after(name):
+        def hook(module, inputs, output):
+            histogram.observe(time.perf_counter() - getattr(started, name), module=name)
+        return hook
+
+    for name in STAGES:
+        stage = getattr(model, name, None)
+        if stage is None:
+            continue
+        stage.register_forward_pre_hook(before(name))
+        stage.register_forward_hook(after(name))
+    return model
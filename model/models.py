@@ -1,6 +1,6 @@
 from pathlib import Path
 
-from botocore.endpoint_provider import Enum
+from enum import Enum
 
 MODELS_DIR = "pretrained_models"
 
@@ -8,7 +8,30 @@ DERAIN = Path(__file__).parent / MODELS_DIR / "derain.pth"
 DEFOCUS = Path(__file__).parent / MODELS_DIR / "defocus.pth"
 DEBLUR = Path(__file__).parent / MODELS_DIR / "deblur.pth"
 
+EXPORTED_DIR = Path(__file__).parent / MODELS_DIR / "exported"
+
 class Model(str, Enum):
     DERAIN = "derain"
     DEFOCUS = "defocus"
     DEBLUR = "deblur"
+
+MODEL_PATHS = {
+    Model.DERAIN.value: DERAIN,
+    Model.DEFOCUS.value: DEFOCUS,
+    Model.DEBLUR.value: DEBLUR,
+}
+
+class Precision(str, Enum):
+    FP32 = "fp32"
+    BF16 = "bf16"
+    INT8 = "int8"
+
+class ImageFormat(str, Enum):
+    JPEG = "jpeg"
+    PNG = "png"
+    WEBP = "webp"
+
+    @classmethod
+    def from_extension(cls, extension: str) -> "ImageFormat":
+        extension = extension.lower().lstrip(".")
+        return cls(cls.JPEG if extension == "jpg" else extension)
@@ -0,0 +1,76 @@
+"""Reduced-precision variants of a loaded Restormer.
+
+- bf16 runs the forward under CPU autocast, on CPUs which support bf16
+- int8 dynamically quantizes the 1x1 convolutions of Attention and
+  FeedForward, which are run as linear layers over the channels
+"""
+import torch
+import torch.nn as nn
+
+from .models import Precision
+
+POINTWISE = {
+    "Attention": ("qkv", "project_out"),
+    "FeedForward": ("project_in", "project_out"),
+}
+
+# torch.ao came with torch 1.10, before that it was torch.quantization
+quantization = torch.ao.quantization if hasattr(torch, "ao") else torch.quantization
+
+
+def bf16_supported() -> bool:
+    # CPU autocast came with torch 1.10 as well, older ones run bf16 in fp32
+    if not hasattr(torch, "autocast"):
+        return False
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class Autocast(nn.Module):
+    def __init__(self, model: nn.Module, dtype=torch.bfloat16):
+        super().__init__()
+        self.model = model
+        self.dtype = dtype
+
+    def forward(self, x):
+        with torch.autocast("cpu", dtype=self.dtype):
+            return self.model(x).float()
+
+
+class PointwiseLinear(nn.Module):
+    """A 1x1 convolution computed as a linear layer over the channels"""
+
+    def __init__(self, conv: nn.Conv2d):
+        super().__init__()
+        self.linear = nn.Linear(
+            conv.in_channels, conv.out_channels, bias=conv.bias is not None
+        )
+        self.linear.weight.data.copy_(conv.weight.data[:, :, 0, 0])
+        if conv.bias is not None:
+            self.linear.bias.data.copy_(conv.bias.data)
+
+    def forward(self, x):
+        return self.linear(x.permute(0, 2, 3, 1)).permute(0, 3, 1, 2)
+
+
+def quantize_int8(model: nn.Module) -> nn.Module:
+    for module in list(model.modules()):
+        for name in POINTWISE.get(type(module).__name__.replace("Fast", ""), ()):
+            conv = getattr(module, name)
+            if isinstance(conv, nn.Conv2d) and conv.kernel_size == (1, 1):
+                setattr(module, name, PointwiseLinear(conv))
+    return quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def apply_precision(model: nn.Module, precision: str) -> nn.Module:
+    precision = Precision(precision)
+    if precision == Precision.BF16:
+        if not bf16_supported():
+            print("bf16 isn't supported by this CPU or torch, running in fp32")
+            return model
+        return Autocast(model).eval()
+    if precision == Precision.INT8:
+        return quantize_int8(model)
+    return model
@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+import torch
+
+from .models import MODEL_PATHS, Model, Precision
+
+WARMUP_SIZE = 64
+
+
+def model_nbytes(model: torch.nn.Module) -> int:
+    # exported graphs keep their weights as constants outside the state dict
+    if hasattr(model, "nbytes"):
+        return model.nbytes
+    total = 0
+    for value in model.state_dict().values():
+        # quantized layers store their packed weights as a tuple
+        for tensor in value if isinstance(value, tuple) else (value,):
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModelRegistry:
+    """Keeps loaded models resident across requests.
+
+    Models are kept per precision in least recently used order and evicted
+    once their combined size goes over ``memory_budget`` bytes. The model
+    which was requested last is never evicted, even if it alone exceeds
+    the budget.
+
+    Models load outside the lock, so the ones which are resident are
+    handed out while another one loads. Requests for a model which is
+    loading wait for that load.
+    """
+
+    def __init__(
+        self, loader: Callable[[Path, str], torch.nn.Module], memory_budget: int
+    ):
+        self.loader = loader
+        self.memory_budget = memory_budget
+        self._models: "OrderedDict[str, torch.nn.Module]" = OrderedDict()
+        self._sizes = {}
+        self._loading: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model: str, precision: str = Precision.FP32) -> torch.nn.Module:
+        name = Model(model).value
+        precision = Precision(precision).value
+        key = f"{name}:{precision}"
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            waiting = key in self._loading
+            if not waiting:
+                self._loading[key] = Future()
+            loading = self._loading[key]
+        if waiting:
+            return loading.result()
+
+        try:
+            loaded = self.loader(MODEL_PATHS[name], precision)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            loading.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self._models[key] = loaded
+            self._sizes[key] = model_nbytes(loaded)
+            self._evict(keep=key)
+        loading.set_result(loaded)
+        return loaded
+
+    def _evict(self, keep: str):
+        while self.memory_used > self.memory_budget and len(self._models) > 1:
+            name = next(iter(self._models))
+            if name == keep:
+                break
+            del self._models[name]
+            del self._sizes[name]
+
+    def evict(self, model: str, precision: str = Precision.FP32):
+        key = f"{Model(model).value}:{Precision(precision).value}"
+        with self._lock:
+            self._models.pop(key, None)
+            self._sizes.pop(key, None)
+
+    @property
+    def memory_used(self) -> int:
+        return sum(self._sizes.values())
+
+    @property
+    def resident(self):
+        return list(self._models.keys())
+
+    def warm_up(
+        self,
+        models: Iterable[str],
+        precision: str = Precision.FP32,
+        size: Optional[int] = None,
+    ):
+        size = size or WARMUP_SIZE
+        dummy = torch.zeros(1, 3, size, size)
+        for name in models:
+            model = self.get(name, precision)
+            # the first forward pays for lazy initialisation of the kernels
+            with torch.no_grad():
+                model(dummy)
+
+
+def parse_model_list(value: str):
+    value = value.strip()
+    if not value:
+        return []
+    if value == "all":
+        return [model.value for model in Model]
+    return [Model(name.strip()).value for name in value.split(",") if name.strip()]
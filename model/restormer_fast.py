@@ -0,0 +1,83 @@
+"""Copy-free execution of the Restormer architecture.
+
+``optimize`` turns a ``Restormer`` from ``restormer_arch.py`` into one that
+produces the same output while avoiding most of the activation copies of
+the reference implementation:
+
+- LayerNorm normalises over the channel dimension in place of permuting
+  to ``b (h w) c`` and back
+- attention heads are split with ``reshape`` instead of einops and use
+  ``scaled_dot_product_attention`` when torch has it
+- the model and its input use the channels-last memory format
+
+The parameters keep their names, so the same checkpoints load before or
+after the conversion.
+"""
+import torch
+import torch.nn.functional as F
+
+EPS = 1e-5
+
+
+def layer_norm_forward(self, x):
+    body = self.body
+    if hasattr(body, "bias"):
+        # a channels-last tensor permuted to b h w c is contiguous
+        normalized = F.layer_norm(
+            x.permute(0, 2, 3, 1), body.normalized_shape, body.weight, body.bias, EPS
+        )
+        return normalized.permute(0, 3, 1, 2)
+    sigma = x.var(1, keepdim=True, unbiased=False)
+    return x * torch.rsqrt(sigma + EPS) * body.weight.view(1, -1, 1, 1)
+
+
+def attention_forward(self, x):
+    b, c, h, w = x.shape
+    heads = self.num_heads
+
+    qkv = self.qkv_dwconv(self.qkv(x))
+    q, k, v = qkv.reshape(b, 3, heads, c // heads, h * w).unbind(1)
+
+    q = F.normalize(q, dim=-1)
+    k = F.normalize(k, dim=-1)
+
+    if hasattr(F, "scaled_dot_product_attention"):
+        # the per head temperature is folded into q, so the scale is 1
+        out = F.scaled_dot_product_attention(q * self.temperature, k, v, scale=1.0)
+    else:
+        attn = (q @ k.transpose(-2, -1)) * self.temperature
+        out = attn.softmax(dim=-1) @ v
+
+    out = out.reshape(b, c, h, w).contiguous(memory_format=torch.channels_last)
+    return self.project_out(out)
+
+
+def restormer_forward(self, inp_img):
+    inp_img = inp_img.contiguous(memory_format=torch.channels_last)
+    return type(self).__mro__[1].forward(self, inp_img)
+
+
+FORWARDS = {
+    "LayerNorm": layer_norm_forward,
+    "Attention": attention_forward,
+    "Restormer": restormer_forward,
+}
+
+_classes = {}
+
+
+def _fast_class(cls):
+    if cls not in _classes:
+        _classes[cls] = type(
+            f"Fast{cls.__name__}", (cls,), {"forward": FORWARDS[cls.__name__]}
+        )
+    return _classes[cls]
+
+
+def optimize(model: torch.nn.Module) -> torch.nn.Module:
+    """Convert ``model`` in place to the copy-free execution path."""
+    for module in model.modules():
+        cls = type(module)
+        if cls.__name__ in FORWARDS:
+            module.__class__ = _fast_class(cls)
+    return model.to(memory_format=torch.channels_last)
@@ -0,0 +1,69 @@
+"""Settings of the inference stack, read from the environment.
+
+Kept apart from model.clean so the API can read them without importing
+torch.
+"""
+import os
+
+from .autotune import load_profile
+from .models import Precision
+
+# written by python -m model.autotune for this machine, the settings it tuned
+# default to its choices
+TUNING_PROFILE = os.getenv("RESTORMER_TUNING_PROFILE") or "tuning.json"
+TUNING = load_profile(TUNING_PROFILE)
+
+# in pixels, 0 runs the whole image through the model in one go
+TILE_SIZE = int(os.getenv("RESTORMER_TILE_SIZE") or 0)
+TILE_OVERLAP = int(os.getenv("RESTORMER_TILE_OVERLAP") or 32)
+
+# in milliseconds, 0 runs every image on its own
+BATCH_WINDOW = float(os.getenv("RESTORMER_BATCH_WINDOW") or TUNING.get("batch_window") or 0)
+MAX_BATCH = int(os.getenv("RESTORMER_MAX_BATCH") or TUNING.get("batch") or 4)
+
+# thread runs inference inside the API process, process in separate workers
+BACKEND = os.getenv("RESTORMER_BACKEND") or TUNING.get("backend") or "thread"
+WORKER_PROCESSES = int(os.getenv("RESTORMER_WORKER_PROCESSES") or TUNING.get("processes") or 1)
+# tasks run at the same time, 0 leaves them to worker.py with the database queue
+WORKERS = int(os.getenv("RESTORMER_WORKERS") or TUNING.get("workers") or 1)
+# torch threads of every forward, or of every worker process, 0 leaves torch to pick
+THREADS = int(os.getenv("RESTORMER_THREADS") or TUNING.get("threads") or 0)
+# none, cores or smt, see model.topology
+PINNING = os.getenv("RESTORMER_PINNING") or TUNING.get("pinning") or "none"
+
+# reference runs restormer_arch.py as it is, fast the copy-free channels-last path
+EXECUTION = os.getenv("RESTORMER_EXECUTION") or "reference"
+
+# eager runs the PyTorch module, torchscript a frozen graph cached in pretrained_models/exported
+ENGINE = os.getenv("RESTORMER_ENGINE") or "eager"
+
+# fp32, bf16 or int8, used when a request doesn't ask for a precision
+PRECISION = Precision(os.getenv("RESTORMER_PRECISION") or "fp32")
+
+# times every TransformerBlock stage of the forward, adds a little overhead
+MODULE_TIMING = os.getenv("RESTORMER_MODULE_TIMING", "").lower() in ("1", "true", "yes")
+
+# in pixels, previews are restored with the longest side scaled down to it
+PREVIEW_SIZE = int(os.getenv("RESTORMER_PREVIEW_SIZE") or 512)
+
+# encoder settings of the formats results are written in
+JPEG_QUALITY = int(os.getenv("RESTORMER_JPEG_QUALITY") or 95)
+PNG_COMPRESSION = int(os.getenv("RESTORMER_PNG_COMPRESSION") or 3)
+# above 100 webp is lossless
+WEBP_QUALITY = int(os.getenv("RESTORMER_WEBP_QUALITY") or 90)
+
+# in MBs, models are evicted least recently used first once they go over it
+MODEL_MEMORY_BUDGET = int(os.getenv("RESTORMER_MODEL_MEMORY") or 512)
+
+# in MBs, restored images kept to be reused by the next image of the same size
+BUFFER_POOL_MEMORY = int(os.getenv("RESTORMER_BUFFER_POOL_MEMORY") or 256)
+
+# in MBs, shared by the images restored at the same time, 0 takes 3/4 of the
+# memory available at startup
+INFERENCE_MEMORY = int(os.getenv("RESTORMER_INFERENCE_MEMORY") or 0)
+# images with more pixels are rejected before they're decoded
+MAX_PIXELS = int(os.getenv("RESTORMER_MAX_PIXELS") or 40_000_000)
+# downscales images which don't fit in the inference memory instead of rejecting them
+DOWNSCALE = os.getenv("RESTORMER_DOWNSCALE", "false").lower() in ("1", "true", "yes")
+# peak bytes of the forward per pixel, 0 uses the ones measured for the execution
+BYTES_PER_PIXEL = int(os.getenv("RESTORMER_BYTES_PER_PIXEL") or 0)
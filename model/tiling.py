@@ -0,0 +1,73 @@
+from typing import Callable, List, Optional
+
+import torch
+
+
+def tile_positions(size: int, tile: int, overlap: int) -> List[int]:
+    if size <= tile:
+        return [0]
+    stride = tile - overlap
+    positions = list(range(0, size - tile, stride))
+    positions.append(size - tile)
+    return positions
+
+
+def tile_weight(tile_h: int, tile_w: int, overlap: int) -> torch.Tensor:
+    """Feathering mask which ramps linearly over the overlapping border.
+
+    The ramp never reaches zero so the tiles at the edges of the image,
+    which have no neighbour to blend with, still get their full output.
+    """
+    def ramp(size):
+        weight = torch.ones(size)
+        width = min(overlap, size // 2)
+        if width > 0:
+            edge = torch.arange(1, width + 1, dtype=torch.float32) / (width + 1)
+            weight[:width] = edge
+            weight[-width:] = edge.flip(0)
+        return weight
+
+    return (ramp(tile_h)[:, None] * ramp(tile_w)[None, :])[None, None]
+
+
+def run_tiled(
+    model: Callable[[torch.Tensor], torch.Tensor],
+    input_: torch.Tensor,
+    tile: int,
+    overlap: int,
+    batch_size: int = 1,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> torch.Tensor:
+    """Run ``model`` over overlapping ``tile`` x ``tile`` crops of ``input_``.
+
+    ``input_`` must already be padded to the size the model expects, the
+    tile size and overlap should be multiples of the same value. Peak
+    activation memory depends on the tile size and ``batch_size``, the
+    number of tiles passed to the model at once, not on the image.
+    ``progress`` is called with the tiles done and the total after every
+    batch of tiles.
+    """
+    b, c, H, W = input_.shape
+    tile_h, tile_w = min(tile, H), min(tile, W)
+    overlap = min(overlap, tile - 1)
+
+    output = torch.zeros_like(input_)
+    weights = torch.zeros(1, 1, H, W, dtype=input_.dtype)
+    weight = tile_weight(tile_h, tile_w, overlap).to(input_.dtype)
+
+    positions = [
+        (y, x)
+        for y in tile_positions(H, tile_h, overlap)
+        for x in tile_positions(W, tile_w, overlap)
+    ]
+    for start in range(0, len(positions), batch_size):
+        chunk = positions[start:start + batch_size]
+        tiles = torch.cat([input_[:, :, y:y + tile_h, x:x + tile_w] for y, x in chunk])
+        restored = model(tiles).split(b)
+        for (y, x), tile_output in zip(chunk, restored):
+            output[:, :, y:y + tile_h, x:x + tile_w] += tile_output * weight
+            weights[:, :, y:y + tile_h, x:x + tile_w] += weight
+        if progress:
+            progress(start + len(chunk), len(positions))
+
+    return output.div_(weights)
@@ -0,0 +1,110 @@
+"""The CPUs this process may run on, grouped into cores and NUMA nodes.
+
+Read from /sys, so it only tells more than a flat list of CPUs on Linux.
+"""
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+SYS_CPU = Path("/sys/devices/system/cpu")
+
+# none leaves the scheduler to place threads, cores gives every worker
+# threads of its own physical cores with one CPU each, smt adds their siblings
+PINNINGS = ("none", "cores", "smt")
+
+
+def available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _read_int(path: Path, default: int) -> int:
+    try:
+        return int(path.read_text().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def _node(cpu: int) -> int:
+    try:
+        for entry in (SYS_CPU / f"cpu{cpu}").iterdir():
+            if entry.name.startswith("node") and entry.name[4:].isdigit():
+                return int(entry.name[4:])
+    except OSError:
+        pass
+    return 0
+
+
+def physical_cores() -> List[List[int]]:
+    """The available CPUs of every physical core, ordered by NUMA node.
+
+    Consecutive cores share a node, so splitting the list into even chunks
+    keeps the chunks on one node where the counts allow.
+    """
+    cores: Dict[tuple, List[int]] = {}
+    for cpu in available_cpus():
+        topology = SYS_CPU / f"cpu{cpu}" / "topology"
+        package = _read_int(topology / "physical_package_id", 0)
+        # without a topology every CPU counts as a core of its own
+        core = _read_int(topology / "core_id", cpu)
+        cores.setdefault((_node(cpu), package, core), []).append(cpu)
+    return [cores[key] for key in sorted(cores)]
+
+
+def cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return ""
+
+
+def machine() -> Dict[str, object]:
+    """What a tuning profile has to match to be used on this machine"""
+    cores = physical_cores()
+    return {
+        "model": cpu_model(),
+        "cpus": sum(len(siblings) for siblings in cores),
+        "cores": len(cores),
+        "nodes": len({_node(siblings[0]) for siblings in cores}),
+    }
+
+
+def cpu_sets(workers: int, threads: int, pinning: str) -> Optional[List[List[int]]]:
+    """The CPUs each of ``workers`` is pinned to, None when they aren't.
+
+    Every worker gets ``threads`` cores of its own, or an even share of
+    them when ``threads`` is 0. Workers wrap around to the first cores
+    when there aren't enough.
+    """
+    if pinning not in PINNINGS:
+        raise ValueError(f"unknown pinning {pinning!r}, expected one of {', '.join(PINNINGS)}")
+    if pinning == "none":
+        return None
+    cores = physical_cores()
+    if pinning == "cores":
+        cores = [siblings[:1] for siblings in cores]
+    per_worker = threads or max(1, len(cores) // max(1, workers))
+    sets = []
+    for worker in range(workers):
+        first = worker * per_worker
+        chosen = [cores[(first + i) % len(cores)] for i in range(per_worker)]
+        sets.append(sorted({cpu for siblings in chosen for cpu in siblings}))
+    return sets
+
+
+def pin(cpus: List[int]):
+    """Pin every thread of this process, and the ones it starts later, to ``cpus``"""
+    if not hasattr(os, "sched_setaffinity"):
+        return
+    # the affinity of a thread is its own, new threads inherit the one of their parent
+    for thread in os.listdir("/proc/self/task"):
+        try:
+            os.sched_setaffinity(int(thread), cpus)
+        except OSError:
+            # the thread is gone already
+            pass
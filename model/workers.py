@@ -0,0 +1,251 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .topology import pin
+
+MONITOR_INTERVAL = 0.5
+
+
+class WorkerCrashed(Exception):
+    pass
+
+
+class InferenceError(Exception):
+    pass
+
+
+def _worker_main(requests, results, threads=0, cpus=None):
+    # before torch starts its threads, so they inherit the affinity
+    if cpus:
+        pin(cpus)
+    # imported here so the parent can import this module from model.clean
+    import torch
+
+    from .clean import registry, restore_array, warm_up
+
+    if threads:
+        torch.set_num_threads(threads)
+    warm_up()
+    # no job, the worker tells it's ready with its pid
+    results.put((None, None, os.getpid()))
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        job_id, models, precision, shape, input_name, output_name = request
+        input_shm = SharedMemory(name=input_name)
+        output_shm = SharedMemory(name=output_name)
+        image = output = None
+        try:
+            image = np.ndarray(shape, np.uint8, buffer=input_shm.buf)
+            output = np.ndarray(shape, np.uint8, buffer=output_shm.buf)
+            chain = [registry.get(model, precision) for model in models]
+
+            def progress(done, total):
+                results.put((job_id, None, (done, total)))
+
+            restore_array(image, chain, out=output, progress=progress)
+            results.put((job_id, None, None))
+        except Exception:
+            results.put((job_id, traceback.format_exc(), None))
+        finally:
+            # the views have to go before the shared memory can be closed
+            image = output = None
+            input_shm.close()
+            output_shm.close()
+
+
+class _Job:
+    def __init__(self, job_id: int, progress: Optional[Callable[[int, int], None]]):
+        self.id = job_id
+        self.progress = progress
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+
+
+class _Slot:
+    def __init__(self, context, results, threads=0, cpus=None):
+        self.requests = context.Queue()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(self.requests, results, threads, cpus),
+            daemon=True,
+        )
+        self.process.start()
+        self.job: Optional[_Job] = None
+
+
+class InferencePool:
+    """Runs inference in separate worker processes.
+
+    Every worker holds its own resident models. Decoded images and their
+    results are handed over through shared memory, only the job metadata
+    goes through the queues. Workers which die are replaced, the job they
+    were running fails with ``WorkerCrashed``. Workers run ``threads``
+    torch threads each, and the i-th is pinned to ``cpu_sets[i]`` when
+    it's given.
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        threads: int = 0,
+        cpu_sets: Optional[List[List[int]]] = None,
+    ):
+        self.processes = max(1, processes)
+        self.threads = threads
+        self.cpu_sets = cpu_sets
+        self._context = mp.get_context("spawn")
+        self._results = None
+        self._slots: List[_Slot] = []
+        self._idle: "queue.Queue[int]" = queue.Queue()
+        self._jobs: Dict[int, _Job] = {}
+        self._warm = set()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._running = False
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        self._results = self._context.Queue()
+        self._running = True
+        for i in range(self.processes):
+            self._slots.append(self._new_slot(i))
+            self._idle.put(i)
+        for target in (self._collect, self._monitor):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._running = False
+        for slot in self._slots:
+            slot.requests.put(None)
+        for slot in self._slots:
+            slot.process.join(timeout=5)
+            if slot.process.is_alive():
+                slot.process.terminate()
+        self._results.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._slots, self._threads = [], []
+
+    def _new_slot(self, index: int) -> _Slot:
+        cpus = self.cpu_sets[index] if self.cpu_sets else None
+        return _Slot(self._context, self._results, self.threads, cpus)
+
+    @property
+    def busy(self) -> int:
+        return sum(1 for slot in self._slots if slot.job is not None)
+
+    @property
+    def alive(self) -> int:
+        return sum(1 for slot in self._slots if slot.process.is_alive())
+
+    @property
+    def ready(self) -> int:
+        """Workers which are alive and done warming up"""
+        return sum(
+            1
+            for slot in self._slots
+            if slot.process.is_alive() and slot.process.pid in self._warm
+        )
+
+    def run(
+        self,
+        image: np.ndarray,
+        models: List[str],
+        precision: str,
+        out: Optional[np.ndarray] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> np.ndarray:
+        """Restore ``image`` with each of ``models`` in turn in a worker"""
+        image = np.ascontiguousarray(image, np.uint8)
+        input_shm = SharedMemory(create=True, size=image.nbytes)
+        output_shm = SharedMemory(create=True, size=image.nbytes)
+        try:
+            np.ndarray(image.shape, np.uint8, buffer=input_shm.buf)[:] = image
+
+            job = _Job(next(self._counter), progress)
+            index = self._idle.get()
+            try:
+                with self._lock:
+                    slot = self._slots[index]
+                    slot.job = job
+                    self._jobs[job.id] = job
+                slot.requests.put(
+                    (
+                        job.id,
+                        list(models),
+                        precision,
+                        image.shape,
+                        input_shm.name,
+                        output_shm.name,
+                    )
+                )
+                job.done.wait()
+            finally:
+                with self._lock:
+                    self._slots[index].job = None
+                    self._jobs.pop(job.id, None)
+                self._idle.put(index)
+
+            if job.error is not None:
+                raise job.error
+            result = np.ndarray(image.shape, np.uint8, buffer=output_shm.buf)
+            if out is None:
+                return result.copy()
+            np.copyto(out, result)
+            # the view has to go before the shared memory can be closed
+            del result
+            return out
+        finally:
+            for shm in (input_shm, output_shm):
+                shm.close()
+                shm.unlink()
+
+    def _collect(self):
+        while True:
+            result = self._results.get()
+            if result is None:
+                break
+            job_id, error, progress = result
+            if job_id is None:
+                self._warm.add(progress)
+                continue
+            with self._lock:
+                job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            if progress is not None:
+                if job.progress:
+                    job.progress(*progress)
+                continue
+            if error is not None:
+                job.error = InferenceError(error)
+            job.done.set()
+
+    def _monitor(self):
+        while self._running:
+            with self._lock:
+                for i, slot in enumerate(self._slots):
+                    if slot.process.is_alive() or not self._running:
+                        continue
+                    print(f"Inference worker {slot.process.pid} died, restarting it")
+                    self._warm.discard(slot.process.pid)
+                    job = slot.job
+                    self._slots[i] = self._new_slot(i)
+                    self._slots[i].job = job
+                    if job is not None:
+                        job.error = WorkerCrashed(slot.process.exitcode)
+                        job.done.set()
+            time.sleep(MONITOR_INTERVAL)
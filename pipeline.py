@@ -0,0 +1,233 @@
+"""Running tasks, in the API process or in separate worker processes.
+
+The handlers here are what the job queue calls for every entry. The API
+runs them on its own worker threads, ``worker.py`` runs them in processes
+of their own pulling from the database queue.
+"""
+import os
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from model import inference
+from model.inference import buffers, memory
+from utils.cache import InFlight
+from utils.db import (
+    clear_task_preview,
+    get_job_tasks,
+    get_task,
+    set_task_preview_uploaded_to,
+    set_task_uploaded_to,
+    update_job_status,
+    update_task_status,
+)
+from utils.events import task_events
+from utils.jobs import QueueBackend, get_queue
+from utils.metrics import STAGE_SECONDS
+from utils.sqlite_models import Task, TaskStage, TaskStatus
+from utils.upload import LOCAL_BUCKET, object_link, upload, upload_all, upload_pool
+
+# memory runs the queue inside the API process, database shares it through
+# the database with worker.py processes on this host or others
+QUEUE_BACKEND = os.getenv("RESTORMER_QUEUE_BACKEND") or "memory"
+# in seconds, a worker which doesn't renew its lease for this long is taken for dead
+QUEUE_LEASE = float(os.getenv("RESTORMER_QUEUE_LEASE") or 30)
+# times an entry is leased before it's failed, when its workers keep dying
+QUEUE_MAX_ATTEMPTS = int(os.getenv("RESTORMER_QUEUE_MAX_ATTEMPTS") or 3)
+
+in_flight = InFlight()
+OUTPUT_THREADS = int(os.getenv("RESTORMER_OUTPUT_THREADS") or 2)
+outputs = ThreadPoolExecutor(OUTPUT_THREADS, thread_name_prefix="output")
+# restored images waiting to be encoded and uploaded, a worker waits for a
+# slot before it hands its result over, so they can't pile up in memory
+output_slots = threading.BoundedSemaphore(
+    int(os.getenv("RESTORMER_OUTPUT_BACKLOG") or OUTPUT_THREADS * 2)
+)
+
+
+def set_task_status(task_id: int, status: TaskStatus, **event) -> None:
+    update_task_status(task_id, status)
+    task_events.publish(task_id, {"status": status, **event})
+
+
+def task_links(task_id: int):
+    task = get_task(task_id)
+    link = {"source_link": "", "output_link": "", "preview_link": ""}  # to avoid None
+    if task:
+        link["source_link"] = object_link(task.source, task.uploaded_to)
+        link["output_link"] = object_link(
+            task.output, task.output_uploaded_to or task.uploaded_to
+        )
+        if task.preview:
+            link["preview_link"] = object_link(task.preview, task.preview_uploaded_to)
+    return link
+
+
+def upload_preview(task_id: int, filename: str, preview_image: memoryview) -> None:
+    place = upload(filename, preview_image)
+    set_task_preview_uploaded_to(task_id, place)
+    task_events.publish(
+        task_id,
+        {
+            "status": TaskStatus.PROCESSING,
+            "stage": TaskStage.PREVIEW,
+            "preview_link": object_link(filename, place),
+        },
+    )
+
+
+def finish_task(
+    task: Task, restored: np.ndarray, preview_upload: Optional[Future]
+) -> None:
+    try:
+        with STAGE_SECONDS.time(stage="encode"):
+            output_image = inference.stack().encode_image(
+                restored, Path(task.output).suffix
+            )
+        buffers.put(restored)
+
+        set_task_status(task.id, TaskStatus.UPLOADING)
+        with STAGE_SECONDS.time(stage="upload"):
+            uploaded_to = upload_all(
+                {task.source: LOCAL_BUCKET / task.source, task.output: output_image}
+            )
+
+        if preview_upload:
+            # the full result must not be overwritten by a late preview
+            try:
+                preview_upload.result()
+            except Exception:
+                # the preview is best effort, the full result is still served
+                traceback.print_exc()
+                clear_task_preview(task.id)
+        set_task_uploaded_to(
+            task.id, uploaded_to[task.source], uploaded_to[task.output]
+        )
+        set_task_status(
+            task.id, TaskStatus.FINISHED, stage=TaskStage.FULL, **task_links(task.id)
+        )
+    except Exception:
+        set_task_status(task.id, TaskStatus.FAILED)
+        traceback.print_exc()
+    finally:
+        in_flight.release(task.content_hash, task.id)
+
+
+def clean_image_concurrently(
+    task_id: int, models: List[str], precision: str
+) -> Optional[Future]:
+    set_task_status(task_id, TaskStatus.PROCESSING)
+    task = get_task(task_id)
+    if not task:
+        return None
+
+    preview_upload = None
+
+    def publish_preview(preview_image):
+        nonlocal preview_upload
+        # the full resolution forward starts while the preview uploads
+        preview_upload = upload_pool.submit(
+            upload_preview, task_id, task.preview, preview_image
+        )
+
+    def publish_progress(done, total):
+        task_events.publish(
+            task_id,
+            {
+                "status": TaskStatus.PROCESSING,
+                "progress": {"done": done, "total": total},
+            },
+        )
+
+    try:
+        # waits until the memory admission estimated for the image is free
+        with memory.reserve(task.memory_estimate or 0):
+            restored = inference.stack().clean(
+                LOCAL_BUCKET / task.source,
+                models,
+                precision,
+                preview=publish_preview if task.preview else None,
+                image_format=Path(task.output).suffix,
+                progress=publish_progress,
+                scale=task.scale,
+            )
+    except Exception:
+        set_task_status(task_id, TaskStatus.FAILED)
+        in_flight.release(task.content_hash, task_id)
+        raise
+
+    # the worker moves on to the next task while the result is encoded and
+    # uploaded
+    output_slots.acquire()
+    try:
+        future = outputs.submit(finish_task, task, restored, preview_upload)
+    except BaseException:
+        output_slots.release()
+        raise
+    future.add_done_callback(lambda _: output_slots.release())
+    return future
+
+
+def clean_job_concurrently(
+    key: str, job_id: int, models: List[str], precision: str
+) -> None:
+    # the tasks of a job run one after the other on the worker which picked
+    # the job up, the other workers stay free for single uploads
+    update_job_status(job_id, TaskStatus.PROCESSING)
+    finishing = []
+    for task in get_job_tasks(job_id):
+        # a job taken over from a worker which died carries on where it was
+        if task.status in (TaskStatus.FINISHED, TaskStatus.FAILED):
+            continue
+        try:
+            finishing.append(clean_image_concurrently(task.id, models, precision))
+        except Exception:
+            traceback.print_exc()
+    wait([future for future in finishing if future])
+    update_job_status(job_id, TaskStatus.FINISHED)
+
+
+def job_key(job_id: int) -> str:
+    # jobs share the queue with tasks, whose keys are their ids
+    return f"job:{job_id}"
+
+
+def fail_queue_entry(key, *args) -> None:
+    """Called when the workers running an entry kept dying"""
+    if isinstance(key, str) and key.startswith("job:"):
+        job_id = int(key.split(":", 1)[1])
+        tasks = [
+            task
+            for task in get_job_tasks(job_id)
+            if task.status not in (TaskStatus.FINISHED, TaskStatus.FAILED)
+        ]
+        update_job_status(job_id, TaskStatus.FAILED)
+    else:
+        task = get_task(key)
+        tasks = [task] if task else []
+    for task in tasks:
+        set_task_status(task.id, TaskStatus.FAILED)
+        in_flight.release(task.content_hash, task.id)
+
+
+def make_queue(workers: int) -> QueueBackend:
+    options = {}
+    if QUEUE_BACKEND == "database":
+        options = {
+            "lease": QUEUE_LEASE,
+            "max_attempts": QUEUE_MAX_ATTEMPTS,
+            "on_failed": fail_queue_entry,
+        }
+    return get_queue(
+        QUEUE_BACKEND,
+        clean_image_concurrently,
+        workers=workers,
+        max_size=int(os.getenv("RESTORMER_QUEUE_SIZE") or 16),
+        order=os.getenv("RESTORMER_QUEUE_ORDER") or "fifo",
+        handlers={"job": clean_job_concurrently},
+        **options,
+    )
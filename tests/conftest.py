@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+
+import pytest
+import torch
+
+# the tests import model and utils from the root of the project
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def small_restormer():
+    """Builds a Restormer small enough to run quickly, with random weights
+    which are the same on every call"""
+    from model.clean import restormer_arch
+
+    def build(**overrides):
+        torch.manual_seed(0)
+        options = dict(
+            inp_channels=3,
+            out_channels=3,
+            dim=16,
+            num_blocks=[1, 1, 1, 1],
+            num_refinement_blocks=1,
+            heads=[1, 1, 1, 1],
+            ffn_expansion_factor=2.66,
+            bias=False,
+            LayerNorm_type="WithBias",
+            dual_pixel_task=False,
+        )
+        options.update(overrides)
+        return restormer_arch()["Restormer"](**options).eval()
+
+    return build
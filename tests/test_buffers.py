@@ -0,0 +1,32 @@
+import numpy as np
+
+from model.buffers import BufferPool
+
+
+def test_buffers_of_a_shape_are_reused():
+    pool = BufferPool()
+    buffer = pool.get((4, 6, 3))
+    pool.put(buffer)
+
+    assert pool.get((4, 6, 3)) is buffer
+    assert pool.nbytes == 0
+
+
+def test_least_recently_used_shapes_go_over_the_byte_cap():
+    # room for two 100 byte buffers
+    pool = BufferPool(per_shape=2, max_bytes=250)
+    first, second, third = (np.empty((10, 10 + i, 1), np.uint8) for i in range(3))
+    pool.put(first)
+    pool.put(second)
+    pool.put(third)
+
+    assert pool.nbytes <= 250
+    assert pool.get(first.shape) is not first
+    assert pool.get(third.shape) is third
+
+
+def test_buffers_bigger_than_the_cap_are_not_kept():
+    pool = BufferPool(max_bytes=10)
+    pool.put(np.empty((4, 4, 3), np.uint8))
+
+    assert pool.nbytes == 0
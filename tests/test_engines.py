@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+import torch
+
+from model.clean import restore_array
+from model.engines import EagerEngine, ExportedModel, TorchScriptEngine
+from model.restormer_fast import optimize
+
+# in levels of the uint8 output, the frozen graph fuses some of the ops
+TOLERANCE = 1
+
+# not multiples of img_multiple_of, nor the size the graph was traced at
+SIZES = [(37, 37), (50, 29)]
+
+
+@pytest.mark.parametrize("execution", ["reference", "fast"])
+def test_torchscript_matches_eager(small_restormer, tmp_path, execution):
+    checkpoint = tmp_path / "random.pth"
+    torch.save({"params": small_restormer().state_dict()}, str(checkpoint))
+
+    def build():
+        model = small_restormer()
+        return optimize(model) if execution == "fast" else model
+
+    eager = EagerEngine().load(build, checkpoint, execution)
+    engine = TorchScriptEngine(tmp_path / "exported")
+    engine.load(build, checkpoint, execution)
+    # the second load comes from the artifact on disk
+    exported = engine.load(lambda: pytest.fail("rebuilt the model"), checkpoint, execution)
+    assert isinstance(exported, ExportedModel)
+    assert exported.nbytes > 0
+
+    for height, width in SIZES:
+        image = np.random.default_rng(height).integers(0, 256, (height, width, 3), np.uint8)
+        expected = restore_array(image, eager, tile=0)
+        restored = restore_array(image, exported, tile=0)
+        diff = np.abs(expected.astype(np.int16) - restored.astype(np.int16))
+        assert restored.shape == image.shape
+        assert diff.max() <= TOLERANCE
@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+
+from model.registry import ModelRegistry
+
+
+def test_a_model_loads_once_for_concurrent_requests():
+    loads = []
+    release = threading.Event()
+
+    def loader(path, precision):
+        loads.append(path)
+        release.wait(5)
+        return torch.nn.Linear(2, 2)
+
+    registry = ModelRegistry(loader, memory_budget=1 << 20)
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(registry.get, "derain") for _ in range(4)]
+        release.set()
+        models = [future.result() for future in futures]
+
+    assert len(loads) == 1
+    assert all(model is models[0] for model in models)
+
+
+def test_resident_models_are_served_while_another_one_loads():
+    loading = threading.Event()
+    release = threading.Event()
+
+    def loader(path, precision):
+        if "deblur" in str(path):
+            loading.set()
+            release.wait(5)
+        return torch.nn.Linear(2, 2)
+
+    registry = ModelRegistry(loader, memory_budget=1 << 20)
+    derain = registry.get("derain")
+    with ThreadPoolExecutor(1) as pool:
+        cold = pool.submit(registry.get, "deblur")
+        assert loading.wait(5)
+        # doesn't wait for the deblur load to finish
+        assert registry.get("derain") is derain
+        release.set()
+        cold.result()
+
+
+def test_a_failed_load_is_retried_by_the_next_request():
+    attempts = []
+
+    def loader(path, precision):
+        attempts.append(path)
+        if len(attempts) == 1:
+            raise OSError("checkpoint missing")
+        return torch.nn.Linear(2, 2)
+
+    registry = ModelRegistry(loader, memory_budget=1 << 20)
+    with pytest.raises(OSError):
+        registry.get("derain")
+    assert registry.get("derain") is not None
+    assert len(attempts) == 2
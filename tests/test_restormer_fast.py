@@ -0,0 +1,34 @@
+import copy
+
+import pytest
+import torch
+
+from model.restormer_fast import optimize
+
+# the fast path reorders the reductions of the norms and the attention
+TOLERANCE = 1e-4
+
+
+# WithBias and BiasFree norms take different branches of the fast LayerNorm
+@pytest.mark.parametrize("layer_norm", ["WithBias", "BiasFree"])
+# two heads split the channels, the size isn't square so h and w can't swap
+@pytest.mark.parametrize("heads", [1, 2])
+def test_fast_path_matches_the_reference(small_restormer, layer_norm, heads):
+    reference = small_restormer(LayerNorm_type=layer_norm, heads=[heads] * 4)
+    fast = optimize(copy.deepcopy(reference))
+    torch.manual_seed(1)
+    input_ = torch.rand(2, 3, 48, 64)
+
+    with torch.no_grad():
+        expected = reference(input_)
+        restored = fast(input_)
+
+    torch.testing.assert_close(restored, expected, rtol=TOLERANCE, atol=TOLERANCE)
+
+
+def test_fast_path_loads_the_reference_checkpoints(small_restormer):
+    reference = small_restormer()
+    fast = optimize(small_restormer())
+
+    assert fast.state_dict().keys() == reference.state_dict().keys()
+    fast.load_state_dict(reference.state_dict())
@@ -0,0 +1,46 @@
+import numpy as np
+import torch
+
+from model.clean import forward, pad_input, restore_array, to_tensor
+
+# not a multiple of the tile or of 8, so the tiles overlap unevenly and the
+# input is padded
+HEIGHT, WIDTH = 75, 101
+TILE, OVERLAP = 48, 16
+
+# tiles can't see the whole image, the channel attention and the norms of
+# Restormer differ a little from a single forward near the seams
+MAX_DIFF = 8
+MEAN_DIFF = 0.5
+
+
+def random_image():
+    return np.random.default_rng(0).integers(0, 256, (HEIGHT, WIDTH, 3), np.uint8)
+
+
+def test_identity_tiles_blend_back_to_the_input():
+    input_, _, _ = pad_input(to_tensor(random_image()))
+    identity = torch.nn.Identity()
+
+    whole = forward(identity, input_, tile=0)
+    tiled = forward(identity, input_, tile=TILE, tile_overlap=OVERLAP, tile_batch=3)
+
+    # the blend weights sum back to one, up to float rounding
+    torch.testing.assert_close(tiled, whole, rtol=0, atol=1e-6)
+    # which doesn't survive quantizing the result
+    image = random_image()
+    tiled_image = restore_array(image, identity, tile=TILE, tile_overlap=OVERLAP)
+    np.testing.assert_array_equal(tiled_image, restore_array(image, identity, tile=0))
+    np.testing.assert_array_equal(tiled_image, image)
+
+
+def test_tiled_restormer_stays_close_to_a_single_forward(small_restormer):
+    image, model = random_image(), small_restormer()
+
+    whole = restore_array(image, model, tile=0)
+    tiled = restore_array(image, model, tile=TILE, tile_overlap=OVERLAP)
+
+    diff = np.abs(whole.astype(np.int16) - tiled.astype(np.int16))
+    assert tiled.shape == whole.shape == image.shape
+    assert diff.max() <= MAX_DIFF
+    assert diff.mean() <= MEAN_DIFF
@@ -0,0 +1,48 @@
+import zipfile
+from typing import AsyncIterable, AsyncIterator, List, Tuple
+
+
+class _Chunks:
+    """Write-only file which hands what was written to it back in chunks.
+
+    zipfile can't seek in it, so it writes the sizes of every member in a
+    data descriptor after the member instead of going back to its header.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> List[bytes]:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return [data] if data else []
+
+
+async def stream_zip(
+    entries: AsyncIterable[Tuple[str, AsyncIterable[bytes]]]
+) -> AsyncIterator[bytes]:
+    """Build a zip of ``entries`` while it is being sent.
+
+    Members are stored without compression, the images are compressed
+    already. Only the chunk being written is held in memory, not the
+    archive.
+    """
+    chunks = _Chunks()
+    with zipfile.ZipFile(chunks, "w", zipfile.ZIP_STORED) as archive:
+        async for name, content in entries:
+            with archive.open(name, "w") as member:
+                async for chunk in content:
+                    member.write(chunk)
+                    for data in chunks.take():
+                        yield data
+            for data in chunks.take():
+                yield data
+    for data in chunks.take():
+        yield data
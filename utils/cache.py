@@ -0,0 +1,44 @@
+import hashlib
+import threading
+from typing import Dict, Optional
+
+
+def content_hasher(model: str):
+    digest = hashlib.sha256(model.encode())
+    digest.update(b"\0")
+    return digest
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.in_flight_hits = 0
+        self.misses = 0
+
+
+class InFlight:
+    """Tasks which are queued or running, by the hash of their content."""
+
+    def __init__(self):
+        self._tasks: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, task_id: int) -> int:
+        """Register ``task_id`` for ``key`` unless a task already owns it.
+
+        Returns the id of the task which owns ``key`` afterwards.
+        """
+        with self._lock:
+            return self._tasks.setdefault(key, task_id)
+
+    def get(self, key: str) -> Optional[int]:
+        with self._lock:
+            return self._tasks.get(key)
+
+    def release(self, key: Optional[str], task_id: Optional[int] = None):
+        """Forget ``key``, only if ``task_id`` owns it when one is given"""
+        if key is None:
+            return
+        with self._lock:
+            if task_id is None or self._tasks.get(key) == task_id:
+                self._tasks.pop(key, None)
@@ -1,8 +1,46 @@
-from typing import Optional
+from datetime import datetime
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 
-from utils.sqlite_models import TaskStatus
+from utils.sqlite_models import TaskStage, TaskStatus
 
 class AppState(BaseModel):
     status: TaskStatus
     task_id: Optional[int]
+    stage: Optional[TaskStage] = None
+    admission: Optional[str] = None
+    # peak inference bytes estimated from the size of the image
+    memory_estimate: Optional[int] = None
+    # the image is restored at this scale of the upload when it's downscaled
+    scale: Optional[float] = None
+    queue_position: Optional[int] = None
+    queued_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    uploaded_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class JobState(BaseModel):
+    status: TaskStatus
+    job_id: int
+    total: int
+    # number of tasks of the job in every status
+    tasks: Dict[str, int] = {}
+    queue_position: Optional[int] = None
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class TaskSummary(BaseModel):
+    task_id: int
+    job_id: Optional[int] = None
+    status: TaskStatus
+    stage: Optional[TaskStage] = None
+    model: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class TaskPage(BaseModel):
+    tasks: List[TaskSummary] = []
+    # pass as ?cursor= for the next page, None on the last one
+    next_cursor: Optional[str] = None
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+
+Event = Dict[str, Any]
+
+# statuses after which a task doesn't change anymore
+FINAL_STATUSES = ("finished", "failed")
+
+
+class Broadcaster:
+    """Fans the events of every task out to the connections following it.
+
+    Events are published from the worker threads and delivered on the
+    event loop of each subscriber. The last event of the ``keep`` most
+    recently updated tasks is remembered, so a connection which subscribes
+    halfway through a task starts from where it is.
+    """
+
+    def __init__(self, keep: int = 1024):
+        self.keep = keep
+        self._subscribers: Dict[int, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._last: "OrderedDict[int, Event]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def publish(self, task_id: int, event: Event):
+        event = {"task_id": task_id, **event}
+        with self._lock:
+            self._last[task_id] = event
+            self._last.move_to_end(task_id)
+            while len(self._last) > self.keep:
+                self._last.popitem(last=False)
+            subscribers = list(self._subscribers.get(task_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def last(self, task_id: int) -> Optional[Event]:
+        with self._lock:
+            return self._last.get(task_id)
+
+    async def subscribe(
+        self, task_id: int, first: Event, keepalive: float
+    ) -> AsyncIterator[Optional[Event]]:
+        """Yield ``first`` and then every event of ``task_id`` until its last.
+
+        None is yielded when nothing happened for ``keepalive`` seconds.
+        """
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers.setdefault(task_id, set()).add(subscriber)
+        try:
+            # an event published before subscribing is newer than ``first``
+            event = self.last(task_id) or first
+            yield event
+            while event["status"] not in FINAL_STATUSES:
+                try:
+                    event = await asyncio.wait_for(subscriber[1].get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield event
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(task_id, set())
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    self._subscribers.pop(task_id, None)
+
+
+def server_sent_event(event: Optional[Event]) -> str:
+    if event is None:
+        # a comment, keeps proxies from closing an idle connection
+        return ": keepalive\n\n"
+    return f"data: {json.dumps(event, default=str)}\n\n"
+
+
+task_events = Broadcaster()
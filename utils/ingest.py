@@ -0,0 +1,302 @@
+import os
+import struct
+import uuid
+import zipfile
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Callable, List, Optional, Tuple
+
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from .cache import content_hasher
+from .upload import LOCAL_BUCKET
+
+UPLOADS_DIR = LOCAL_BUCKET / ".uploads"
+
+# bytes of multipart framing allowed on top of the file itself
+MULTIPART_OVERHEAD = 16 * 1024
+
+SNIFF_SIZE = 12
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InvalidContent(Exception):
+    pass
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head.startswith(b"PK\x03\x04"):
+        return "zip"
+    return None
+
+
+# JPEG start of frame markers, which carry the size of the image
+JPEG_FRAME_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# JPEG markers without a length after them
+JPEG_STANDALONE_MARKERS = {0x01, 0xD8, *range(0xD0, 0xD8)}
+
+
+def jpeg_dimensions(file: BinaryIO) -> Optional[Tuple[int, int]]:
+    file.seek(2)
+    while True:
+        byte = file.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+        marker = file.read(1)
+        while marker == b"\xff":
+            marker = file.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        # the image data starts after SOS, no frame header came before it
+        if marker == 0xDA:
+            return None
+        segment = file.read(2)
+        if len(segment) < 2:
+            return None
+        (length,) = struct.unpack(">H", segment)
+        if marker in JPEG_FRAME_MARKERS:
+            frame = file.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">xHH", frame)
+            return width, height
+        file.seek(length - 2, os.SEEK_CUR)
+
+
+def webp_dimensions(head: bytes) -> Optional[Tuple[int, int]]:
+    chunk = head[12:16]
+    if chunk == b"VP8 " and len(head) >= 30:
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(head) >= 25:
+        (bits,) = struct.unpack("<I", head[21:25])
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(head) >= 30:
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        return width, height
+    return None
+
+
+def image_dimensions(path: Path, format: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Width and height from the header of the image, without decoding it"""
+    with open(path, "rb") as file:
+        if format == "png":
+            head = file.read(24)
+            if len(head) < 24:
+                return None
+            return struct.unpack(">II", head[16:24])
+        if format == "webp":
+            return webp_dimensions(file.read(30))
+        if format == "jpeg":
+            return jpeg_dimensions(file)
+    return None
+
+
+class IngestedFile:
+    """A file part written to disk while it is being received.
+
+    The format is taken from the magic bytes, not from the header the
+    client sent, and the content hash is computed as the bytes arrive.
+    """
+
+    def __init__(
+        self, filename: Optional[str], model: str, max_size: int, allowed: List[str]
+    ):
+        UPLOADS_DIR.mkdir(exist_ok=True)
+        self.filename = filename
+        self.path = UPLOADS_DIR / f"{uuid.uuid4()}.part"
+        self.size = 0
+        self.format: Optional[str] = None
+        self.max_size = max_size
+        self.allowed = allowed
+        self._hasher = content_hasher(model)
+        self._head = b""
+        self._file = open(self.path, "wb")
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise UploadTooLarge(self.filename)
+        if self.format is None and len(self._head) < SNIFF_SIZE:
+            self._head += data[: SNIFF_SIZE - len(self._head)]
+            if len(self._head) >= SNIFF_SIZE:
+                self._sniff()
+        self._hasher.update(data)
+        self._file.write(data)
+
+    def _sniff(self):
+        self.format = sniff_format(self._head)
+        if self.format not in self.allowed:
+            raise InvalidContent(self.filename)
+
+    def finish(self):
+        self._file.close()
+        if self.format is None:
+            self._sniff()
+
+    @property
+    def digest(self) -> str:
+        return self._hasher.hexdigest()
+
+    def dimensions(self) -> Optional[Tuple[int, int]]:
+        return image_dimensions(self.path, self.format)
+
+    def move_to(self, destination: Path):
+        os.replace(self.path, destination)
+        self.path = destination
+
+    def discard(self):
+        self._file.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+async def ingest(
+    content_type: str,
+    content_length: Optional[int],
+    stream: AsyncIterator[bytes],
+    new_file: Callable[[str, Optional[str]], Optional[IngestedFile]],
+    max_size: int,
+) -> List[IngestedFile]:
+    """Stream a multipart/form-data body to disk.
+
+    ``new_file`` is called with the field name and filename of every file
+    part and returns the ``IngestedFile`` to write it to, or None to skip
+    the part. ``max_size`` bounds the whole body. Files written so far are
+    removed if the body is rejected.
+    """
+    if content_length is not None and content_length > max_size + MULTIPART_OVERHEAD:
+        raise UploadTooLarge()
+
+    mime, options = parse_options_header(content_type)
+    if mime != b"multipart/form-data" or b"boundary" not in options:
+        raise InvalidContent()
+
+    files: List[IngestedFile] = []
+    current: List[Optional[IngestedFile]] = [None]
+    header = {"field": b"", "value": b""}
+    headers = {}
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        headers[header["field"].lower()] = header["value"]
+        header["field"], header["value"] = b"", b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+        headers.clear()
+        current[0] = None
+        if b"filename" not in disposition:
+            return
+        name = disposition.get(b"name", b"").decode()
+        filename = disposition[b"filename"].decode() or None
+        ingested = new_file(name, filename)
+        if ingested is not None:
+            files.append(ingested)
+            current[0] = ingested
+
+    def on_part_data(data, start, end):
+        if current[0] is not None:
+            current[0].write(data[start:end])
+
+    def on_part_end():
+        if current[0] is not None:
+            current[0].finish()
+        current[0] = None
+
+    parser = MultipartParser(
+        options[b"boundary"],
+        {
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        },
+    )
+
+    received = 0
+    try:
+        async for chunk in stream:
+            received += len(chunk)
+            if received > max_size + MULTIPART_OVERHEAD:
+                raise UploadTooLarge()
+            parser.write(chunk)
+        parser.finalize()
+    except MultipartParseError as error:
+        for ingested in files:
+            ingested.discard()
+        raise InvalidContent() from error
+    except BaseException:
+        for ingested in files:
+            ingested.discard()
+        raise
+    return files
+
+
+def extract_zip(
+    path: Path, new_file: Callable[[str], IngestedFile], max_files: int
+) -> Tuple[List[IngestedFile], List[str]]:
+    """Write every file of the zip at ``path`` to its own ``IngestedFile``.
+
+    Members are streamed, so each one is bounded by the ``max_size`` of
+    the file ``new_file`` returns for it. The names of members which are
+    too big, not an allowed format or over ``max_files`` are returned in
+    place of being written.
+    """
+    files: List[IngestedFile] = []
+    rejected: List[str] = []
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise InvalidContent(path.name)
+    with archive:
+        for info in archive.infolist():
+            name = Path(info.filename)
+            # folders and the resource forks macOS adds to archives
+            if info.is_dir() or name.name.startswith(".") or "__MACOSX" in name.parts:
+                continue
+            if len(files) >= max_files:
+                rejected.append(info.filename)
+                continue
+            ingested = new_file(name.name)
+            try:
+                with archive.open(info) as member:
+                    for chunk in iter(lambda: member.read(CHUNK_SIZE), b""):
+                        ingested.write(chunk)
+                ingested.finish()
+            except (UploadTooLarge, InvalidContent, zipfile.BadZipFile):
+                ingested.discard()
+                rejected.append(info.filename)
+                continue
+            files.append(ingested)
+    return files, rejected
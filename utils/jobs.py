@@ -0,0 +1,331 @@
+import itertools
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import traceback
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from datetime import timezone
+from enum import Enum
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from .db import (
+    claim_queue_entry,
+    count_queue_entries,
+    enqueue,
+    finish_queue_entry,
+    queue_position,
+    renew_lease,
+    requeue_expired_leases,
+)
+from .metrics import STAGE_SECONDS
+from .sqlite_models import QueueStatus
+
+
+class QueueOrder(str, Enum):
+    FIFO = "fifo"
+    PRIORITY = "priority"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class UnknownQueue(ValueError):
+    pass
+
+
+class QueueBackend(ABC):
+    """Where submitted tasks wait for a worker.
+
+    Every entry is run by the handler it was submitted with, looked up by
+    name in ``handlers``, or by ``handler`` when it has none. Handlers are
+    called with the key of the entry and its arguments.
+    """
+
+    name = ""
+
+    def __init__(
+        self,
+        handler: Callable[..., None],
+        workers: int = 1,
+        max_size: int = 16,
+        order: QueueOrder = QueueOrder.FIFO,
+        handlers: Optional[Dict[str, Callable[..., None]]] = None,
+    ):
+        self.handler = handler
+        self.handlers = handlers or {}
+        self.workers = workers
+        self.max_size = max_size
+        self.order = QueueOrder(order)
+        self._threads: List[threading.Thread] = []
+
+    def _handler(self, name: Optional[str]) -> Callable[..., None]:
+        return self.handlers[name] if name else self.handler
+
+    def _start_workers(self, target):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=target, name=f"inference-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def alive(self) -> int:
+        """Worker threads which are running"""
+        return sum(1 for thread in self._threads if thread.is_alive())
+
+    @abstractmethod
+    def start(self):
+        ...
+
+    @abstractmethod
+    def stop(self):
+        ...
+
+    @abstractmethod
+    def submit(
+        self, task_id: Hashable, *args, priority: int = 0, handler: Optional[str] = None
+    ) -> int:
+        """Queue ``task_id`` and return its 1-based position in the queue."""
+
+    @abstractmethod
+    def position(self, task_id: Hashable) -> Optional[int]:
+        ...
+
+    @property
+    @abstractmethod
+    def depth(self) -> int:
+        ...
+
+    @property
+    @abstractmethod
+    def busy(self) -> int:
+        ...
+
+
+class JobQueue(QueueBackend):
+    """Bounded queue of tasks served by a pool of inference worker threads.
+
+    Jobs are ordered first come first served, or by descending priority and
+    then arrival when ``order`` is ``QueueOrder.PRIORITY``. The queue only
+    lives in this process.
+    """
+
+    name = "memory"
+
+    def __init__(self, handler: Callable[..., None], workers: int = 1, **kwargs):
+        super().__init__(handler, max(1, workers), **kwargs)
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._pending: Dict[Hashable, Tuple[int, int]] = {}
+        self._running: Dict[Hashable, str] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._start_workers(self._work)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put((float("inf"), next(self._counter), None, None, (), 0.0))
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(
+        self, task_id: Hashable, *args, priority: int = 0, handler: Optional[str] = None
+    ) -> int:
+        with self._lock:
+            if len(self._pending) >= self.max_size:
+                raise QueueFull(task_id)
+            if self.order != QueueOrder.PRIORITY:
+                priority = 0
+            key = (-priority, next(self._counter))
+            self._pending[task_id] = key
+            self._queue.put((*key, task_id, handler, args, time.perf_counter()))
+            return self._position(key)
+
+    def position(self, task_id: Hashable) -> Optional[int]:
+        with self._lock:
+            key = self._pending.get(task_id)
+            if key is None:
+                return None
+            return self._position(key)
+
+    def _position(self, key: Tuple[int, int]) -> int:
+        return sum(1 for other in self._pending.values() if other < key) + 1
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    @property
+    def busy(self) -> int:
+        return len(self._running)
+
+    def _work(self):
+        while True:
+            _, _, task_id, handler, args, queued = self._queue.get()
+            if task_id is None:
+                break
+            STAGE_SECONDS.observe(time.perf_counter() - queued, stage="queue")
+            with self._lock:
+                self._pending.pop(task_id, None)
+                self._running[task_id] = threading.current_thread().name
+            try:
+                self._handler(handler)(task_id, *args)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._running.pop(task_id, None)
+
+
+class LeasedQueue(QueueBackend):
+    """Queue kept in the database, shared by every process using it.
+
+    Workers in any process, on any host reaching the database, claim
+    entries with a lease of ``lease`` seconds which they renew while the
+    handler runs. When a lease runs out, because its worker died or lost
+    the database, the entry goes back to the queue for another worker,
+    until it was leased ``max_attempts`` times. Then it's dropped and
+    ``on_failed`` is called with its key and arguments.
+
+    ``workers`` can be 0 in processes which only submit. Keys and
+    arguments have to be JSON serializable. A handler which returns a
+    ``Future`` keeps its lease until the future is done, while the worker
+    moves on to the next entry.
+    """
+
+    name = "database"
+
+    def __init__(
+        self,
+        handler: Callable[..., None],
+        workers: int = 1,
+        lease: float = 30.0,
+        poll_interval: float = 0.5,
+        max_attempts: int = 3,
+        on_failed: Optional[Callable[..., None]] = None,
+        **kwargs,
+    ):
+        super().__init__(handler, max(0, workers), **kwargs)
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.on_failed = on_failed
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._running: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        # not one of the workers, so it isn't counted as alive
+        self._heartbeat_thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if not self.workers:
+            return
+        self._stopping.clear()
+        self._start_workers(self._work)
+        self._heartbeat_thread = threading.Thread(
+            target=self._heartbeat, name="queue-heartbeat", daemon=True
+        )
+        self._heartbeat_thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._heartbeat_thread:
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+
+    def submit(
+        self, task_id: Hashable, *args, priority: int = 0, handler: Optional[str] = None
+    ) -> int:
+        if count_queue_entries(QueueStatus.QUEUED) >= self.max_size:
+            raise QueueFull(task_id)
+        if self.order != QueueOrder.PRIORITY:
+            priority = 0
+        key = json.dumps(task_id)
+        enqueue(key, handler or "", json.dumps(args), priority)
+        return queue_position(key) or 1
+
+    def position(self, task_id: Hashable) -> Optional[int]:
+        return queue_position(json.dumps(task_id))
+
+    @property
+    def depth(self) -> int:
+        return count_queue_entries(QueueStatus.QUEUED)
+
+    @property
+    def busy(self) -> int:
+        return count_queue_entries(QueueStatus.LEASED)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                for entry in requeue_expired_leases(self.max_attempts):
+                    print(f"Giving up on {entry.key} after {entry.attempts} leases")
+                    if self.on_failed:
+                        self.on_failed(json.loads(entry.key), *json.loads(entry.args))
+                entry = claim_queue_entry(self.owner, self.lease)
+            except Exception:
+                traceback.print_exc()
+                entry = None
+            if entry is None:
+                self._stopping.wait(self.poll_interval)
+                continue
+
+            # the database keeps UTC without its timezone
+            queued = entry.queued_at.replace(tzinfo=timezone.utc).timestamp()
+            STAGE_SECONDS.observe(max(0.0, time.time() - queued), stage="queue")
+            with self._lock:
+                self._running[entry.id] = threading.current_thread().name
+            result = None
+            try:
+                result = self._handler(entry.handler)(
+                    json.loads(entry.key), *json.loads(entry.args)
+                )
+            except Exception:
+                traceback.print_exc()
+            finally:
+                if isinstance(result, Future):
+                    result.add_done_callback(
+                        lambda _, entry_id=entry.id: self._done(entry_id)
+                    )
+                else:
+                    self._done(entry.id)
+
+    def _done(self, entry_id: int):
+        try:
+            finish_queue_entry(entry_id, self.owner)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._running.pop(entry_id, None)
+
+    def _heartbeat(self):
+        while not self._stopping.wait(self.lease / 3):
+            with self._lock:
+                running = list(self._running)
+            for entry_id in running:
+                try:
+                    if not renew_lease(entry_id, self.owner, self.lease):
+                        print(f"Lost the lease of queue entry {entry_id}")
+                except Exception:
+                    traceback.print_exc()
+
+
+QUEUES = {backend.name: backend for backend in (JobQueue, LeasedQueue)}
+
+
+def get_queue(name: str, handler: Callable[..., None], **kwargs) -> QueueBackend:
+    if name not in QUEUES:
+        raise UnknownQueue(f"unknown queue {name!r}, expected one of {', '.join(QUEUES)}")
+    return QUEUES[name](handler, **kwargs)
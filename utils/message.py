@@ -6,10 +6,14 @@ class ErrorTypes(str, Enum):
     BIG_FILE_SIZE = "BIG_FILE_SIZE"
     UPLOAD_TO_S3_NOT_SUCCESSFUL = "UPLOAD_TO_S3_NOT_SUCCESSFUL"
     S3_ERROR = "S3_ERROR"
-    ALREADY_PROCESSING = "ALREADY_PROCESSING"
+    QUEUE_FULL = "QUEUE_FULL"
+    IMAGE_TOO_LARGE = "IMAGE_TOO_LARGE"
+    NOT_READY = "NOT_READY"
 
 class BadErrorTypes(str, Enum):
     INVALID_CONTENT = "INVALID_CONTENT"
+    TOO_MANY_MODELS = "TOO_MANY_MODELS"
+    INVALID_CURSOR = "INVALID_CURSOR"
 
 class Message(BaseModel):
     type: str
@@ -33,8 +37,12 @@ class BadError(Message):
     details: Optional[str] = "A Bad Error Occured!"
 
 class ResponseErrors(dict, Enum):
-    ALREADY_PROCESSING = Error(reason=ErrorTypes.ALREADY_PROCESSING).model_dump()
+    QUEUE_FULL = Error(reason=ErrorTypes.QUEUE_FULL).model_dump()
+    IMAGE_TOO_LARGE = Error(reason=ErrorTypes.IMAGE_TOO_LARGE).model_dump()
+    NOT_READY = Error(reason=ErrorTypes.NOT_READY).model_dump()
     BIG_FILE_SIZE = Error(reason=ErrorTypes.BIG_FILE_SIZE).model_dump()
     UPLOAD_TO_S3_NOT_SUCCESSFUL = Error(reason=ErrorTypes.UPLOAD_TO_S3_NOT_SUCCESSFUL).model_dump()
     S3_ERROR = Error(reason=ErrorTypes.S3_ERROR).model_dump()
     INVALID_CONTENT = BadError(reason=BadErrorTypes.INVALID_CONTENT).model_dump()
+    TOO_MANY_MODELS = BadError(reason=BadErrorTypes.TOO_MANY_MODELS).model_dump()
+    INVALID_CURSOR = BadError(reason=BadErrorTypes.INVALID_CURSOR).model_dump()
@@ -1,5 +1,7 @@
+from datetime import datetime, timezone
 from enum import Enum
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel
 
 class TaskStatus(str, Enum):
@@ -8,9 +10,75 @@ class TaskStatus(str, Enum):
     PROCESSING = "processing"
     UPLOADING = "uploading"
     FINISHED = "finished"
+    FAILED = "failed"
+
+class TaskStage(str, Enum):
+    PREVIEW = "preview"
+    FULL = "full"
+
+class Job(SQLModel, table=True):
+    """A bulk submission, its images are the tasks pointing to it"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    status: TaskStatus = Field(default=TaskStatus.PENDING, index=True)
+    total: int = 0
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
 
 class Task(SQLModel, table=True):
+    # the history of a user is listed newest first, filtered by one of these
+    __table_args__ = (
+        Index("ix_task_owner_created_at", "owner", "created_at", "id"),
+        Index("ix_task_owner_status_created_at", "owner", "status", "created_at", "id"),
+        Index("ix_task_owner_model_created_at", "owner", "model", "created_at", "id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
+    job_id: Optional[int] = Field(default=None, foreign_key="job.id", index=True)
+    # username of whoever uploaded it
+    owner: Optional[str] = None
+    # the models it runs, joined by +
+    model: Optional[str] = None
     source: str
     output: str
     uploaded_to: Optional[str] = None
+    output_uploaded_to: Optional[str] = None
+    preview: Optional[str] = None
+    preview_uploaded_to: Optional[str] = None
+    # the last result which is ready to be linked to
+    stage: Optional[TaskStage] = None
+    # from the header of the source, before any downscaling
+    width: Optional[int] = None
+    height: Optional[int] = None
+    # accept, queue or downscale, with the peak inference bytes estimated
+    admission: Optional[str] = None
+    memory_estimate: Optional[int] = None
+    scale: Optional[float] = None
+    # sha256 of the model name and the uploaded bytes
+    content_hash: Optional[str] = Field(default=None, index=True)
+    status: TaskStatus = Field(default=TaskStatus.PENDING, index=True)
+    created_at: Optional[datetime] = Field(
+        default_factory=lambda: datetime.now(timezone.utc), index=True
+    )
+    queued_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    uploaded_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class QueueStatus(str, Enum):
+    QUEUED = "queued"
+    LEASED = "leased"
+
+class QueueEntry(SQLModel, table=True):
+    """A task or job waiting in the database queue, or leased by a worker"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    # JSON of the key it was submitted with, a task id or job:<id>
+    key: str = Field(index=True, unique=True)
+    handler: str = ""
+    # JSON list of the arguments of the handler
+    args: str = "[]"
+    priority: int = Field(default=0, index=True)
+    status: QueueStatus = Field(default=QueueStatus.QUEUED, index=True)
+    # the worker holding the lease, until lease_expires_at unless it renews it
+    owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    attempts: int = 0
+    queued_at: Optional[datetime] = None
@@ -1,36 +1,159 @@
+import io
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Tuple, Union
-
-from boto3 import client
-import botocore.exceptions
+from typing import Dict, Iterator, Optional, Tuple, Union
 
 from . import message
-
-s3 = client("s3")
+from .metrics import S3_ERRORS
 
 S3_BUCKET = os.getenv("S3_BUCKET")
+# e.g. http://localhost:5000 to upload to a local S3 stand-in
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_MAX_CONNECTIONS = int(os.getenv("S3_MAX_CONNECTIONS") or 10)
+S3_UPLOAD_ATTEMPTS = int(os.getenv("S3_UPLOAD_ATTEMPTS") or 3)
+# in MBs, bigger files are uploaded in parts of this size
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD") or 8)
+
+BACKOFF = 0.5
+
+READ_CHUNK_SIZE = 64 * 1024
+
 LOCAL_BUCKET = Path("static")
 
-def upload(filename: str, file_data: bytes):
+upload_pool = ThreadPoolExecutor(S3_MAX_CONNECTIONS, thread_name_prefix="upload")
+
+FileData = Union[bytes, memoryview, Path]
+
+
+# boto3 is imported with the first upload, it isn't needed without a bucket
+@lru_cache(maxsize=None)
+def get_s3():
+    import botocore.config
+    from boto3 import client
+
+    # upload_to_s3 retries, retrying in botocore as well would multiply the attempts
+    config = botocore.config.Config(
+        max_pool_connections=S3_MAX_CONNECTIONS,
+        retries={"total_max_attempts": 1, "mode": "standard"},
+    )
+    return client("s3", endpoint_url=S3_ENDPOINT_URL, config=config)
+
+
+@lru_cache(maxsize=None)
+def get_transfer_config():
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=S3_MULTIPART_THRESHOLD * 1024 * 1024,
+        multipart_chunksize=S3_MULTIPART_THRESHOLD * 1024 * 1024,
+        max_concurrency=S3_MAX_CONNECTIONS,
+    )
+
+
+def upload(filename: str, file_data: FileData):
     upload_possible, success = upload_to_s3(filename, file_data)
     if not success:
         upload_to_local(filename, file_data)
         return "local"
     return "s3"
 
-def upload_to_s3(filename: str, file: bytes) -> Tuple[Union[None, message.ResponseErrors, message.Error, message.Success], bool]:
+
+def upload_all(files: Dict[str, FileData]) -> Dict[str, str]:
+    """Upload every file at the same time, each falling back on its own"""
+    futures = {
+        filename: upload_pool.submit(upload, filename, file_data)
+        for filename, file_data in files.items()
+    }
+    return {filename: future.result() for filename, future in futures.items()}
+
+
+def upload_to_s3(filename: str, file: FileData) -> Tuple[Union[None, message.ResponseErrors, message.Error, message.Success], bool]:
     if S3_BUCKET:
-        try:
-            s3_response = s3.put_object(Bucket=S3_BUCKET, Key=filename, Body=file, ACL="public-read")
-        except botocore.exceptions.ClientError as err:
-            return message.Error(data=err.response["Error"], reason=message.ErrorTypes.S3_ERROR), False
+        import boto3.exceptions
+        import botocore.exceptions
 
-        if s3_response["ResponseMetadata"]["HTTPStatusCode"] == 200:
-            return message.Success(data=s3_response), True
-        return message.ResponseErrors.UPLOAD_TO_S3_NOT_SUCCESSFUL, False
+        for attempt in range(S3_UPLOAD_ATTEMPTS):
+            try:
+                _put(filename, file)
+                return message.Success(), True
+            except botocore.exceptions.ClientError as err:
+                error = message.Error(data=err.response["Error"], reason=message.ErrorTypes.S3_ERROR)
+            except (botocore.exceptions.BotoCoreError, boto3.exceptions.S3UploadFailedError) as err:
+                error = message.Error(details=str(err), reason=message.ErrorTypes.UPLOAD_TO_S3_NOT_SUCCESSFUL)
+            S3_ERRORS.inc(reason=error.reason.value)
+            if attempt + 1 < S3_UPLOAD_ATTEMPTS:
+                time.sleep(BACKOFF * 2 ** attempt)
+        return error, False
     return None, False
 
-def upload_to_local(filename: str, file_data: bytes):
-    with open(LOCAL_BUCKET / filename, 'wb') as outfile:
+
+class BufferReader(io.RawIOBase):
+    """A file reading ``buffer`` without copying it first, unlike BytesIO"""
+
+    def __init__(self, buffer: Union[bytes, memoryview]):
+        self._buffer = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        chunk = self._buffer[self._position:self._position + len(b)]
+        b[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        start = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._buffer)}[whence]
+        self._position = max(0, start + offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+def _put(filename: str, file: FileData):
+    extra_args = {"ACL": "public-read"}
+    if isinstance(file, Path):
+        get_s3().upload_file(str(file), S3_BUCKET, filename, ExtraArgs=extra_args, Config=get_transfer_config())
+    else:
+        get_s3().upload_fileobj(BufferReader(file), S3_BUCKET, filename, ExtraArgs=extra_args, Config=get_transfer_config())
+
+
+def object_link(filename: str, place: Optional[str]) -> str:
+    if place == "s3":
+        if S3_ENDPOINT_URL:
+            return f"{S3_ENDPOINT_URL}/{S3_BUCKET}/{filename}"
+        return f"https://{S3_BUCKET}.s3.amazonaws.com/{filename}"
+    if place == "local":
+        return f"/static/{filename}"
+    return ""
+
+
+def read_object(filename: str, place: Optional[str]) -> Iterator[bytes]:
+    """Stream an uploaded file back in chunks from wherever it was put"""
+    if place == "s3":
+        body = get_s3().get_object(Bucket=S3_BUCKET, Key=filename)["Body"]
+        try:
+            yield from body.iter_chunks(READ_CHUNK_SIZE)
+        finally:
+            body.close()
+        return
+    with open(LOCAL_BUCKET / filename, 'rb') as file:
+        yield from iter(lambda: file.read(READ_CHUNK_SIZE), b"")
+
+
+def upload_to_local(filename: str, file_data: FileData):
+    destination = LOCAL_BUCKET / filename
+    if isinstance(file_data, Path):
+        if file_data.resolve() != destination.resolve():
+            destination.write_bytes(file_data.read_bytes())
+        return
+    with open(destination, 'wb') as outfile:
         outfile.write(file_data)
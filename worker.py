@@ -0,0 +1,60 @@
+"""A worker process pulling tasks from the database queue.
+
+Start the API with RESTORMER_QUEUE_BACKEND=database (and RESTORMER_WORKERS=0
+when it shouldn't run any tasks itself), then as many of these as there is
+room for, on this host or on others sharing the database and the storage:
+
+    python worker.py --threads 2
+"""
+import argparse
+import signal
+import sys
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from model import inference  # noqa: E402
+from model.settings import WORKERS  # noqa: E402
+from pipeline import QUEUE_BACKEND, make_queue, outputs  # noqa: E402
+from utils.db import init_db  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=WORKERS or 1,
+        help="tasks run at the same time, RESTORMER_WORKERS by default",
+    )
+    args = parser.parse_args(argv)
+
+    if QUEUE_BACKEND != "database":
+        sys.exit("worker.py needs RESTORMER_QUEUE_BACKEND=database")
+
+    init_db()
+    inference.start()
+    # the error is set instead when the models fail to load
+    while not inference.ready.wait(1.0):
+        if inference.error is not None:
+            sys.exit("Couldn't load the models")
+
+    jobs = make_queue(max(1, args.threads))
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.set())
+
+    jobs.start()
+    print(f"Worker {jobs.owner} pulling tasks with {jobs.workers} threads")
+    stopping.wait()
+
+    # tasks being run are finished, the leases of the others run out
+    jobs.stop()
+    outputs.shutdown()
+    inference.stop()
+
+
+if __name__ == "__main__":
+    main()